@@ -0,0 +1,135 @@
+# Локальное хранилище последней таблицы BGP.
+#
+# Таблица хранится сжатой (table.txt.gz), рядом - snapshot.json с ETag,
+# Last-Modified и SHA-256 содержимого. Изменения проверяются условным
+# запросом: на 304 таблица не скачивается. При загрузке таблица одновременно
+# сжимается на диск, хешируется и разбирается. Если загрузить не удалось или
+# включен HTTP_CACHE_OFFLINE, используется сохраненная копия (при ошибке - с
+# явным предупреждением).
+#
+# Для каждого сервиса запоминается хеш его набора префиксов, чтобы не
+# пересчитывать и не перезаписывать списки, которые не изменились.
+import os
+import gzip
+import json
+import time
+import hashlib
+
+from common.bgp_table import BgpPrefixes
+from common.http_cache import CHUNK_SIZE, CacheMiss, LineSplitter, get_cache
+
+SNAPSHOT_VERSION = 1
+
+
+class BgpSnapshot:
+    def __init__(self, directory, offline=None):
+        self.directory = directory
+        self.offline = get_cache().offline if offline is None else offline
+        self.table_path = os.path.join(directory, 'table.txt.gz')
+        self.meta_path = os.path.join(directory, 'snapshot.json')
+        self.meta = self._load()
+
+    def _load(self):
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return {'version': SNAPSHOT_VERSION, 'services': {}}
+        if meta.get('version') != SNAPSHOT_VERSION:
+            return {'version': SNAPSHOT_VERSION, 'services': {}}
+        meta.setdefault('services', {})
+        return meta
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.meta_path)
+
+    def has_table(self, source=None):
+        if not self.meta.get('sha256') or not os.path.exists(self.table_path):
+            return False
+        return source is None or self.meta.get('source') == source
+
+    @property
+    def digest(self):
+        return self.meta.get('sha256')
+
+    def describe(self):
+        fetched_at = self.meta.get('fetched_at')
+        if not fetched_at:
+            return 'unknown date'
+        return time.strftime('%Y-%m-%d %H:%M UTC', time.gmtime(fetched_at))
+
+    def conditional_headers(self, source):
+        headers = {}
+        if self.has_table(source):
+            if self.meta.get('etag'):
+                headers['If-None-Match'] = self.meta['etag']
+            if self.meta.get('last_modified'):
+                headers['If-Modified-Since'] = self.meta['last_modified']
+        return headers
+
+    async def download(self, session, url, asn_index, timeout=None):
+        # Префиксы по сервисам из новой таблицы или None, если используется
+        # сохраненная таблица (не изменилась, режим offline или ошибка загрузки)
+        if self.offline:
+            if self.has_table():
+                return None
+            raise CacheMiss(url)
+        try:
+            return await self._download(session, url, asn_index, timeout)
+        except Exception as e:
+            if not self.has_table():
+                raise
+            print(f"Warning: failed to download {url} ({e}), using snapshot from {self.describe()}")
+            return None
+
+    async def _download(self, session, url, asn_index, timeout):
+        kwargs = {'headers': self.conditional_headers(url)}
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        async with session.get(url, **kwargs) as response:
+            if response.status == 304 and self.has_table(url):
+                return None
+            response.raise_for_status()
+
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self.table_path + '.part'
+            prefixes = BgpPrefixes(asn_index)
+            splitter = LineSplitter()
+            sha256 = hashlib.sha256()
+            try:
+                with gzip.open(tmp_path, 'wb', compresslevel=6) as f:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        f.write(chunk)
+                        sha256.update(chunk)
+                        prefixes.feed(splitter.feed(chunk))
+                    prefixes.feed(splitter.close())
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            os.replace(tmp_path, self.table_path)
+
+            self.meta.update(
+                source=url,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+                sha256=sha256.hexdigest(),
+                fetched_at=time.time(),
+            )
+            self.save()
+            return prefixes.cidrs
+
+    def is_parsed(self, key):
+        return self.meta.get('parsed') == key
+
+    def mark_parsed(self, key):
+        self.meta['parsed'] = key
+
+    def is_service_current(self, service, digest):
+        return self.meta['services'].get(service) == digest
+
+    def record_service(self, service, digest):
+        self.meta['services'][service] = digest
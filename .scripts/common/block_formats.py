@@ -0,0 +1,108 @@
+# Вывод итогового блок-листа в нескольких форматах за один проход.
+#
+# Для каждого формата задаются имя файла, заголовок и функции, которые
+# превращают IP и домен в строку (None - формат такие записи не поддерживает).
+# Все файлы открываются одновременно с большим буфером, записи перебираются
+# один раз, готовые файлы атомарно заменяют старые. Если содержимое не
+# изменилось (для RPZ - без учета серийного номера SOA), старый файл остается,
+# чтобы ежедневная сборка не давала пустых коммитов.
+import os
+import time
+from collections import namedtuple
+from itertools import zip_longest
+
+WRITE_BUFFER = 1024 * 1024
+RPZ_SOA = "@ IN SOA"
+
+BlockFormat = namedtuple(
+    'BlockFormat', ['file_name', 'header', 'render_ip', 'render_domain', 'volatile'], defaults=[None]
+)
+
+
+def _rpz_ip(ip):
+    return f"32.{'.'.join(reversed(ip.split('.')))}.rpz-ip CNAME ."
+
+
+def _rpz_header():
+    serial = time.strftime('%Y%m%d%H', time.gmtime())
+    return [
+        "$TTL 300",
+        f"{RPZ_SOA} localhost. root.localhost. {serial} 3600 600 86400 300",
+        "  IN NS localhost.",
+        "",
+    ]
+
+
+FORMATS = {
+    'ips': BlockFormat('block-ips.lst', lambda: [], lambda ip: ip, None),
+    'domains': BlockFormat('block-domains.lst', lambda: [], None, lambda d: d),
+    'hosts': BlockFormat(
+        'hosts',
+        lambda: ["127.0.0.1 localhost", "::1 localhost", ""],
+        lambda ip: f"0.0.0.0 {ip}",
+        lambda d: f"0.0.0.0 {d}",
+    ),
+    'dnsmasq': BlockFormat('block-dnsmasq.conf', lambda: [], None, lambda d: f"address=/{d}/#"),
+    'unbound': BlockFormat(
+        'block-unbound.conf', lambda: ["server:"], None, lambda d: f'local-zone: "{d}." always_nxdomain'
+    ),
+    'adguard': BlockFormat('block-adguard.txt', lambda: [], None, lambda d: f"||{d}^"),
+    'rpz': BlockFormat(
+        'block-rpz.zone', _rpz_header, _rpz_ip, lambda d: f"{d} CNAME .\n*.{d} CNAME .", RPZ_SOA
+    ),
+}
+
+
+def _same_content(path, tmp_path, volatile):
+    # Построчное сравнение; строки, начинающиеся с volatile, не учитываются
+    if not os.path.exists(path):
+        return False
+    with open(path, 'r', encoding='utf-8') as old, open(tmp_path, 'r', encoding='utf-8') as new:
+        for old_line, new_line in zip_longest(old, new):
+            if old_line == new_line:
+                continue
+            if volatile and old_line and new_line and \
+                    old_line.startswith(volatile) and new_line.startswith(volatile):
+                continue
+            return False
+    return True
+
+
+def emit_block_lists(output_dir, formats, ips, domains):
+    # ips и domains - уже отсортированные последовательности
+    unknown = [name for name in formats if name not in FORMATS]
+    if unknown:
+        raise ValueError(f"Unknown block list formats: {', '.join(unknown)}")
+
+    outputs = []
+    try:
+        for name in formats:
+            block_format = FORMATS[name]
+            path = os.path.join(output_dir, block_format.file_name)
+            f = open(path + '.tmp', 'w', encoding='utf-8', buffering=WRITE_BUFFER)
+            outputs.append((path, f, block_format))
+            for line in block_format.header():
+                f.write(line + "\n")
+
+        ip_writers = [(f.write, fmt.render_ip) for _, f, fmt in outputs if fmt.render_ip]
+        for ip in ips:
+            for write, render in ip_writers:
+                write(render(ip) + "\n")
+
+        domain_writers = [(f.write, fmt.render_domain) for _, f, fmt in outputs if fmt.render_domain]
+        for domain in domains:
+            for write, render in domain_writers:
+                write(render(domain) + "\n")
+    except BaseException:
+        for path, f, _ in outputs:
+            f.close()
+            os.remove(path + '.tmp')
+        raise
+
+    for path, f, block_format in outputs:
+        f.close()
+        if _same_content(path, path + '.tmp', block_format.volatile):
+            os.remove(path + '.tmp')
+        else:
+            os.replace(path + '.tmp', path)
+    return [path for path, _, _ in outputs]
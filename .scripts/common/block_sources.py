@@ -0,0 +1,70 @@
+# Параллельная загрузка источников блок-листов.
+#
+# Каждый источник читается потоково, строки разбираются по мере поступления
+# байтов общим нормализатором (hosts, правила AdBlock ||domain^ и простые
+# домены). Для каждого источника запоминаются время загрузки и разбора и
+# ошибка, поэтому медленное зеркало видно в отчете и не задерживает остальные
+# источники. Источник, оборвавшийся на середине, не дает ни одной записи.
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from common.http_cache import stream_lines_sync
+from common.normalize import DOMAIN_REGEX, is_ipv4, normalize_entries
+
+DEFAULT_WORKERS = 8
+DEFAULT_TIMEOUT = 15
+
+SourceResult = namedtuple('SourceResult', ['url', 'ips', 'domains', 'fetch_time', 'parse_time', 'error'])
+
+
+def classify_lines(lines, ips, domains):
+    for line in lines:
+        for item in normalize_entries(line.strip()):
+            item = item.lower()
+            if is_ipv4(item):
+                ips.add(item)
+            elif DOMAIN_REGEX.match(item):
+                domains.add(item)
+
+
+def fetch_block_source(url, timeout=DEFAULT_TIMEOUT):
+    ips = set()
+    domains = set()
+    fetch_time = parse_time = 0.0
+    error = None
+    started = time.perf_counter()
+    try:
+        for lines in stream_lines_sync(url, timeout=timeout):
+            parsed = time.perf_counter()
+            fetch_time += parsed - started
+            classify_lines(lines, ips, domains)
+            started = time.perf_counter()
+            parse_time += started - parsed
+        fetch_time += time.perf_counter() - started
+    except Exception as e:
+        fetch_time += time.perf_counter() - started
+        error = str(e)
+        # Частично прочитанный источник отбрасывается целиком
+        ips = set()
+        domains = set()
+    return SourceResult(url, ips, domains, fetch_time, parse_time, error)
+
+
+def fetch_block_sources(urls, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT):
+    # Результаты в порядке urls
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(urls)))) as pool:
+        return list(pool.map(lambda url: fetch_block_source(url, timeout), urls))
+
+
+def format_report(results):
+    lines = []
+    for result in results:
+        timings = f"fetch {result.fetch_time:.2f}s, parse {result.parse_time:.2f}s"
+        if result.error:
+            lines.append(f"FAILED {result.url} ({timings}): {result.error}")
+        else:
+            lines.append(
+                f"OK     {result.url}: {len(result.domains)} domains, {len(result.ips)} IPs ({timings})"
+            )
+    return "\n".join(lines)
@@ -0,0 +1,96 @@
+# Манифест инкрементальной сборки.
+#
+# Для каждого выходного файла хранится хеш входных данных, из которых он был
+# получен (включая хеш самого файла после записи). Входные данные хешируются до
+# загрузки и разбора: секция конфигурации, sha256 тел источников, содержимое
+# v2fly категорий и исходный код разбора. Если при следующем запуске хеш
+# совпадает, список не пересчитывается и не перезаписывается. Для источников
+# хранится sha256 тела, чтобы изменившийся источник разбирать сразу после
+# загрузки.
+import os
+import json
+import hashlib
+
+MANIFEST_VERSION = 2
+
+
+def hash_file(path):
+    if not os.path.exists(path):
+        return None
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def source_digest(paths):
+    # Хеш исходного кода, от которого зависит результат разбора
+    return digest(*[hash_file(path) for path in paths])
+
+
+def hash_domains(domains):
+    return hashlib.sha256('\n'.join(sorted(domains)).encode('utf-8')).hexdigest()
+
+
+def digest(*parts):
+    data = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class BuildManifest:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.skipped = 0
+        self.rebuilt = 0
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == MANIFEST_VERSION:
+            self.entries = data.get('entries', {})
+
+    def is_current(self, key, inputs):
+        entry = self.entries.get(key)
+        if entry is not None and entry.get('inputs') == inputs:
+            self.skipped += 1
+            return True
+        self.rebuilt += 1
+        return False
+
+    def record(self, key, inputs, result=None):
+        # result - необязательная пометка о результате (например, пустой список)
+        entry = {'inputs': inputs}
+        if result is not None:
+            entry['result'] = result
+        if self.entries.get(key) != entry:
+            self.entries[key] = entry
+            self._dirty = True
+
+    def previous(self, key):
+        # Хеш входных данных key с прошлого запуска (без учета в отчете)
+        return self.entries.get(key, {}).get('inputs')
+
+    def result(self, key):
+        return self.entries.get(key, {}).get('result')
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+    def report(self):
+        return f"Build manifest: {self.rebuilt} lists rebuilt, {self.skipped} unchanged"
@@ -0,0 +1,143 @@
+# План сборки, скомпилированный из parsing-domains.toml.
+#
+# Конфигурация разбирается один раз: url/domains/v2fly приводятся к кортежам,
+# флаги general - к bool, ссылки групп на сервисы разрешаются заранее (с учетом
+# general), неизвестные ссылки собираются в unknown_references. Готовый план
+# кэшируется на диске по хешу файла конфигурации, поэтому в нем хранятся
+# только значения из конфигурации: domains не нормализуются и regexp: не
+# раскрываются, это делает вызывающий код через clean_domains при каждом
+# запуске.
+import os
+import pickle
+import hashlib
+from collections import namedtuple
+
+PLAN_VERSION = 2
+
+ServicePlan = namedtuple('ServicePlan', ['name', 'key', 'urls', 'domains', 'v2fly', 'general'])
+GroupPlan = namedtuple('GroupPlan', ['name', 'urls', 'domains', 'v2fly', 'general', 'includes'])
+BuildPlan = namedtuple('BuildPlan', [
+    'settings', 'services', 'groups', 'v2fly_categories', 'urls', 'unknown_references',
+])
+
+
+def as_tuple(value):
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        return (value,)
+    return tuple(value)
+
+
+def service_general(config):
+    flag = config.get('general', True)
+    if isinstance(flag, str):
+        flag = flag.strip().lower() != 'false'
+    return flag
+
+
+def group_general(config):
+    flag = config.get('general')
+    if flag is None:
+        return True
+    if isinstance(flag, str):
+        return flag.lower() == 'true'
+    return flag
+
+
+def should_include_service(service_general, group_general):
+    if service_general is False:
+        return False
+    if service_general is True:
+        return True
+    if service_general is None:
+        service_general = True
+
+    if group_general is None:
+        group_general = True
+
+    return service_general and group_general
+
+
+def clean_domains(values, clean_line):
+    domains = set()
+    for value in values:
+        result = clean_line(value)
+        if isinstance(result, list):
+            domains.update(result)
+        elif result:
+            domains.add(result)
+    return tuple(sorted(domains))
+
+
+def compile_plan(config):
+    services = []
+    for name, section in config.get('services', {}).items():
+        services.append(ServicePlan(
+            name=name,
+            key=name.lower(),
+            urls=as_tuple(section.get('url')),
+            domains=as_tuple(section.get('domains')),
+            v2fly=as_tuple(section.get('v2fly')),
+            general=service_general(section),
+        ))
+    services_by_key = {service.key: service for service in services}
+
+    groups = []
+    unknown_references = []
+    for name, section in config.get('groups', {}).items():
+        general = group_general(section)
+        includes = []
+        for reference in as_tuple(section.get('include')):
+            service = services_by_key.get(reference.strip().lower())
+            if service is None:
+                unknown_references.append((name, reference))
+            elif should_include_service(service.general, general):
+                includes.append(service.key)
+        groups.append(GroupPlan(
+            name=name,
+            urls=as_tuple(section.get('url')),
+            domains=as_tuple(section.get('domains')),
+            v2fly=as_tuple(section.get('v2fly')),
+            general=general,
+            includes=tuple(includes),
+        ))
+
+    v2fly_categories = set()
+    urls = set()
+    for item in services + groups:
+        v2fly_categories.update(item.v2fly)
+        urls.update(item.urls)
+
+    return BuildPlan(
+        settings=config.get('settings', {}),
+        services=tuple(services),
+        groups=tuple(groups),
+        v2fly_categories=tuple(sorted(v2fly_categories)),
+        urls=tuple(sorted(urls)),
+        unknown_references=tuple(unknown_references),
+    )
+
+
+def load_plan(config_path, load_config, cache_path=None):
+    with open(config_path, 'rb') as f:
+        content = f.read()
+    key = f"{PLAN_VERSION}:{hashlib.sha256(content).hexdigest()}"
+
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached.get('key') == key:
+                return cached['plan']
+        except Exception:
+            pass
+
+    plan = compile_plan(load_config(content))
+    if cache_path:
+        os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'key': key, 'plan': plan}, f)
+        os.replace(tmp_path, cache_path)
+    return plan
@@ -0,0 +1,136 @@
+# Слияние CIDR на целочисленных диапазонах.
+#
+# Префикс разбирается в пару (start, end) целых чисел без создания объектов
+# ipaddress. Диапазоны сортируются и сливаются одним проходом (пересекающиеся
+# и смежные), после чего каждый диапазон раскладывается в минимальный набор
+# CIDR. Результат совпадает со str() от ipaddress.collapse_addresses.
+#
+# Строки необычного вида (маска вместо длины, scope id и т.п.) и ошибочные
+# префиксы разбираются через ipaddress, чтобы ошибки были теми же самыми.
+import re
+import socket
+import ipaddress
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+V4_BITS = 32
+V6_BITS = 128
+NUMPY_THRESHOLD = 10000
+
+_V4_OCTET = r'(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)'
+_V4_RE = re.compile(rf'({_V4_OCTET}\.{_V4_OCTET}\.{_V4_OCTET}\.{_V4_OCTET})(?:/(3[0-2]|[12]?\d))?')
+_V6_RE = re.compile(r'([0-9A-Fa-f:]+)(?:/(12[0-8]|1[01]\d|[1-9]?\d))?')
+
+
+def _from_network(network):
+    return int(network.network_address), int(network.broadcast_address)
+
+
+def parse_v4(net_str):
+    match = _V4_RE.fullmatch(net_str)
+    if match:
+        start = int.from_bytes(socket.inet_aton(match.group(1)), 'big')
+        prefix = int(match.group(2)) if match.group(2) else V4_BITS
+        host_mask = (1 << (V4_BITS - prefix)) - 1
+        if not start & host_mask:
+            return start, start | host_mask
+    return _from_network(ipaddress.IPv4Network(net_str))
+
+
+def parse_v6(net_str):
+    match = _V6_RE.fullmatch(net_str)
+    if match:
+        try:
+            start = int.from_bytes(socket.inet_pton(socket.AF_INET6, match.group(1)), 'big')
+        except OSError:
+            start = None
+        if start is not None:
+            prefix = int(match.group(2)) if match.group(2) else V6_BITS
+            host_mask = (1 << (V6_BITS - prefix)) - 1
+            if not start & host_mask:
+                return start, start | host_mask
+    return _from_network(ipaddress.IPv6Network(net_str))
+
+
+def merge_ranges(ranges):
+    # Сортировка и один проход: сливаем пересекающиеся и смежные диапазоны
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def merge_ranges_numpy(ranges):
+    # То же для IPv4 векторно: диапазоны помещаются в int64
+    data = np.array(ranges, dtype=np.int64)
+    data = data[np.lexsort((data[:, 1], data[:, 0]))]
+    starts = data[:, 0]
+    reach = np.maximum.accumulate(data[:, 1])
+    new_group = np.empty(len(data), dtype=bool)
+    new_group[0] = True
+    new_group[1:] = starts[1:] > reach[:-1] + 1
+    group_starts = starts[new_group]
+    group_ends = np.append(reach[np.flatnonzero(new_group)[1:] - 1], reach[-1])
+    return list(zip(group_starts.tolist(), group_ends.tolist()))
+
+
+def range_to_cidrs(start, end, bits):
+    # Минимальное покрытие диапазона префиксами (как summarize_address_range)
+    while start <= end:
+        size = (end - start + 1).bit_length() - 1
+        if start:
+            size = min(size, (start & -start).bit_length() - 1)
+        yield start, bits - size
+        start += 1 << size
+
+
+def format_v4(start, prefix):
+    return f"{socket.inet_ntoa(start.to_bytes(4, 'big'))}/{prefix}"
+
+
+def format_v6(start, prefix):
+    # inet_ntop иначе записывает адреса с нулевыми старшими 80 битами (::ffff:a.b.c.d)
+    if start >> 48:
+        return f"{socket.inet_ntop(socket.AF_INET6, start.to_bytes(16, 'big'))}/{prefix}"
+    return f"{ipaddress.IPv6Address(start)}/{prefix}"
+
+
+def collapse(ranges, bits, format_cidr):
+    if not ranges:
+        return []
+    if np is not None and bits == V4_BITS and len(ranges) >= NUMPY_THRESHOLD:
+        merged = merge_ranges_numpy(ranges)
+    else:
+        merged = merge_ranges(ranges)
+    return [
+        format_cidr(network, prefix)
+        for start, end in merged
+        for network, prefix in range_to_cidrs(start, end, bits)
+    ]
+
+
+def merge_networks(network_list):
+    v4_ranges = []
+    v6_ranges = []
+
+    for net_str in network_list:
+        net_str = net_str.strip()
+        if not net_str:
+            continue
+
+        try:
+            if '.' in net_str:
+                v4_ranges.append(parse_v4(net_str))
+            elif ':' in net_str:
+                v6_ranges.append(parse_v6(net_str))
+        except Exception as e:
+            print(f"Invalid network skipped: {net_str} - {e}")
+
+    return collapse(v4_ranges, V4_BITS, format_v4), collapse(v6_ranges, V6_BITS, format_v6)
@@ -0,0 +1,157 @@
+# Индекс "домен -> списки и источники", из-за которых он маршрутизируется.
+#
+# Все списки categories/Services/*/*.lst, categories/Groups/*/*.lst,
+# domains.lst и источники из parsing-domains.toml (явные domains, v2fly
+# категории из кэша разбора, url из HTTP-кэша) сводятся в один словарь
+# суффикс -> номера источников. Запрос проверяет сам домен и его родителей,
+# то есть несколько обращений к словарю.
+#
+# Готовый индекс кэшируется на диске; ключ - mtime и размер всех списков,
+# конфигурации, кэша v2fly и время загрузки url в HTTP-кэше.
+import os
+import glob
+import json
+import pickle
+import hashlib
+
+from common.build_plan import clean_domains, load_plan
+from common.http_cache import decode, get_cache
+from common.normalize import normalize_line, normalize_text
+from common.suffix_index import iter_parents
+
+try:
+    import tomllib
+except ModuleNotFoundError:
+    import toml as tomllib
+
+INDEX_VERSION = 1
+LIST_PATTERNS = (
+    'categories/Services/*/*.lst',
+    'categories/Groups/*/*.lst',
+    'domains.lst',
+)
+CONFIG_PATH = '.scripts/config/parsing-domains.toml'
+V2FLY_CACHE_FILE = 'tmp/v2fly-categories.json'
+
+
+class DomainIndex:
+    def __init__(self):
+        self.sources = []
+        self.entries = {}
+
+    def add_source(self, label, domains):
+        source_id = len(self.sources)
+        self.sources.append(label)
+        entries = self.entries
+        for domain in domains:
+            ids = entries.get(domain)
+            if ids is None:
+                entries[domain] = (source_id,)
+            elif ids[-1] != source_id:
+                entries[domain] = ids + (source_id,)
+
+    def lookup(self, domain):
+        # Список (совпавший суффикс, источник), от самого точного суффикса
+        matches = []
+        for suffix in (domain, *iter_parents(domain)):
+            ids = self.entries.get(suffix)
+            if ids:
+                matches.extend((suffix, self.sources[i]) for i in ids)
+        return matches
+
+
+def _read_list(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _clean_config_line(line):
+    # Без раскрытия regexp: план здесь не кэшируется и не влияет на сборку
+    return normalize_line(line.split('#')[0].strip())
+
+
+def _load_plan(config_path):
+    return load_plan(config_path, lambda content: tomllib.loads(content.decode('utf-8')))
+
+
+def _load_v2fly(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('categories', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def index_key(lists, config_path, v2fly_path, plan):
+    cache = get_cache()
+    parts = [INDEX_VERSION]
+    parts += [(path, _stat(path)) for path in lists + [config_path, v2fly_path]]
+    for url in plan.urls:
+        meta = cache.lookup(url)
+        parts.append((url, meta and meta.get('fetched_at')))
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+
+def find_lists(root='.'):
+    paths = []
+    for pattern in LIST_PATTERNS:
+        paths.extend(sorted(glob.glob(os.path.normpath(os.path.join(root, pattern)))))
+    return paths
+
+
+def build_index(lists, plan, v2fly_path=V2FLY_CACHE_FILE):
+    index = DomainIndex()
+    for path in lists:
+        index.add_source(path, _read_list(path))
+
+    v2fly_data = _load_v2fly(v2fly_path) if plan.v2fly_categories else {}
+    cache = get_cache()
+    for section, items in (('services', plan.services), ('groups', plan.groups)):
+        for item in items:
+            prefix = f"config {section}.{item.name}"
+            domains = clean_domains(item.domains, _clean_config_line)
+            if domains:
+                index.add_source(f"{prefix}.domains", domains)
+            for category in item.v2fly:
+                if category in v2fly_data:
+                    index.add_source(f"{prefix}.v2fly {category}", v2fly_data[category])
+            for url in item.urls:
+                if not url.startswith(('http://', 'https://')):
+                    domain = _clean_config_line(url)
+                    if domain:
+                        index.add_source(f"{prefix}.url", [domain])
+                elif cache.lookup(url) is not None:
+                    index.add_source(f"{prefix}.url {url}", normalize_text(decode(cache.read(url))))
+    return index
+
+
+def load_index(cache_path=None, root='.', config_path=CONFIG_PATH, v2fly_path=V2FLY_CACHE_FILE, rebuild=False):
+    lists = find_lists(root)
+    plan = _load_plan(config_path)
+    key = index_key(lists, config_path, v2fly_path, plan)
+
+    if cache_path and not rebuild and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached.get('key') == key:
+                return cached['index']
+        except Exception:
+            pass
+
+    index = build_index(lists, plan, v2fly_path)
+    if cache_path:
+        os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'key': key, 'index': index}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    return index
@@ -0,0 +1,136 @@
+# Интернирование доменов и множества доменов на целочисленных массивах.
+#
+# Каждый нормализованный домен получает целочисленный ID один раз за запуск,
+# а множества сервисов и групп хранятся как отсортированные массивы ID без
+# повторов (4 байта на домен вместо отдельного set[str]). Объединение,
+# разность и пересечение выполняются над массивами: через NumPy, если он
+# установлен, иначе через array из стандартной библиотеки.
+#
+# Домены интернируются сразу при разборе источника, строки снова нужны только
+# при записи списков. Проверки по строке (например, исключения по суффиксам)
+# выполняются через DomainMask один раз на каждый ID таблицы.
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ID_TYPECODE = 'I'
+
+
+def _sorted_ids(ids):
+    if np is not None:
+        return np.unique(np.fromiter(ids, dtype=np.uint32))
+    return array(ID_TYPECODE, sorted(set(ids)))
+
+
+class DomainSet:
+    __slots__ = ('ids',)
+
+    def __init__(self, ids=None):
+        # ids: отсортированный массив без повторов
+        if ids is None:
+            ids = np.empty(0, dtype=np.uint32) if np is not None else array(ID_TYPECODE)
+        self.ids = ids
+
+    @classmethod
+    def from_ids(cls, ids):
+        return cls(_sorted_ids(ids))
+
+    @classmethod
+    def union_all(cls, sets):
+        arrays = [s.ids for s in sets if s is not None and len(s)]
+        if not arrays:
+            return cls()
+        if len(arrays) == 1:
+            return cls(arrays[0])
+        if np is not None:
+            return cls(np.unique(np.concatenate(arrays)))
+        merged = set()
+        for ids in arrays:
+            merged.update(ids)
+        return cls(array(ID_TYPECODE, sorted(merged)))
+
+    def union(self, other):
+        return DomainSet.union_all([self, other])
+
+    def difference(self, other):
+        if not len(self) or not len(other):
+            return DomainSet(self.ids)
+        if np is not None:
+            return DomainSet(np.setdiff1d(self.ids, other.ids, assume_unique=True))
+        excluded = set(other.ids)
+        return DomainSet(array(ID_TYPECODE, (i for i in self.ids if i not in excluded)))
+
+    def intersection(self, other):
+        if not len(self) or not len(other):
+            return DomainSet()
+        if np is not None:
+            return DomainSet(np.intersect1d(self.ids, other.ids, assume_unique=True))
+        small, large = (self, other) if len(self) <= len(other) else (other, self)
+        common = set(small.ids)
+        return DomainSet(array(ID_TYPECODE, (i for i in large.ids if i in common)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        if np is not None:
+            return iter(self.ids.tolist())
+        return iter(self.ids)
+
+    def __contains__(self, domain_id):
+        pos = bisect_left(self.ids, domain_id)
+        return pos < len(self.ids) and self.ids[pos] == domain_id
+
+
+class DomainTable:
+    def __init__(self):
+        self._ids = {}
+        self._names = []
+
+    def intern(self, domain):
+        domain_id = self._ids.get(domain)
+        if domain_id is None:
+            domain_id = len(self._names)
+            self._ids[domain] = domain_id
+            self._names.append(domain)
+        return domain_id
+
+    def set_of(self, domains):
+        return DomainSet.from_ids(self.intern(domain) for domain in domains)
+
+    def names(self, domain_set):
+        names = self._names
+        return [names[i] for i in domain_set]
+
+    def mask(self, predicate):
+        return DomainMask(self, predicate)
+
+    def __len__(self):
+        return len(self._names)
+
+
+class DomainMask:
+    # ID таблицы, для которых predicate(domain) истинен. ID выдаются по
+    # возрастанию, поэтому при каждом обращении проверяются только домены,
+    # интернированные после предыдущего.
+
+    def __init__(self, table, predicate):
+        self.table = table
+        self.predicate = predicate
+        self._checked = 0
+        self._ids = array(ID_TYPECODE)
+
+    def ids(self):
+        names = self.table._names
+        predicate = self.predicate
+        for domain_id in range(self._checked, len(names)):
+            if predicate(names[domain_id]):
+                self._ids.append(domain_id)
+        self._checked = len(names)
+        if np is not None:
+            return DomainSet(np.array(self._ids, dtype=np.uint32))
+        return DomainSet(array(ID_TYPECODE, self._ids))
@@ -0,0 +1,29 @@
+# Реестр загрузок на один запуск (single-flight).
+#
+# Одновременные и повторные запросы с одним ключом (обычно URL) ждут одну
+# и ту же задачу и получают общий результат. Результат не должен изменяться
+# вызывающим кодом.
+import asyncio
+
+
+class FetchRegistry:
+    def __init__(self):
+        self._tasks = {}
+        self.requests = 0
+        self.saved = 0
+
+    async def get(self, key, factory):
+        self.requests += 1
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+        else:
+            self.saved += 1
+        return await task
+
+    def report(self):
+        # В parsing-domains задача - обновление копии url в HTTP-кэше (условный
+        # запрос, если копия не свежая); разбор тел сюда не входит
+        return (f"Refreshed {len(self._tasks)} unique sources for {self.requests} lookups, "
+                f"saved {self.saved} duplicate refreshes")
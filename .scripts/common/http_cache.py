@@ -0,0 +1,446 @@
+# Дисковый кэш HTTP-ответов с условными запросами.
+#
+# Тело ответа хранится в <key>.body, метаданные (ETag, Last-Modified, время
+# загрузки и последнего использования) - в <key>.json. При повторной загрузке
+# отправляются If-None-Match/If-Modified-Since, и на 304 используется тело из
+# кэша. Размер кэша ограничен, лишнее вытесняется по LRU. Большие источники
+# можно читать потоково (stream_lines_sync): строки отдаются по мере загрузки,
+# а тело одновременно пишется в кэш; fetch_file_sync так же сохраняет тело в
+# файл, не держа его в памяти. refresh только обновляет копию в кэше,
+# чтобы по sha256 тела решить, нужен ли разбор. Вытеснение выполняется один
+# раз при завершении процесса, если за запуск в кэш что-то записывалось.
+#
+# Настройки через переменные окружения:
+#   HTTP_CACHE_DIR        каталог кэша (tmp/http-cache от корня репозитория)
+#   HTTP_CACHE_MAX_AGE    сколько секунд ответ считается свежим без запроса (0)
+#   HTTP_CACHE_MAX_STALE  сколько секунд можно отдавать копию при ошибке сети (7 дней)
+#   HTTP_CACHE_MAX_SIZE   предельный размер кэша в байтах (512 МБ)
+#   HTTP_CACHE_OFFLINE    1 - работать только из кэша, без сети
+import os
+import json
+import time
+import atexit
+import codecs
+import shutil
+import hashlib
+import threading
+from urllib.parse import urlencode
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_CACHE_DIR = os.path.join(REPO_ROOT, "tmp", "http-cache")
+DEFAULT_MAX_AGE = 0
+DEFAULT_MAX_STALE = 7 * 24 * 3600
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class CacheMiss(Exception):
+    def __init__(self, url):
+        super().__init__(f"not cached (offline): {url}")
+        self.url = url
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    return int(value)
+
+
+def _env_flag(name):
+    return os.environ.get(name, '').strip().lower() in ('1', 'true', 'yes')
+
+
+def cache_url(url, params=None):
+    if not params:
+        return url
+    return url + ('&' if '?' in url else '?') + urlencode(params, doseq=True)
+
+
+class HttpCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_age=DEFAULT_MAX_AGE,
+                 max_stale=DEFAULT_MAX_STALE, max_size=DEFAULT_MAX_SIZE, offline=False):
+        self.cache_dir = os.path.join(REPO_ROOT, cache_dir)
+        self.max_age = max_age
+        self.max_stale = max_stale
+        self.max_size = max_size
+        self.offline = offline
+        self._evict_scheduled = False
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            cache_dir=os.environ.get('HTTP_CACHE_DIR') or DEFAULT_CACHE_DIR,
+            max_age=_env_int('HTTP_CACHE_MAX_AGE', DEFAULT_MAX_AGE),
+            max_stale=_env_int('HTTP_CACHE_MAX_STALE', DEFAULT_MAX_STALE),
+            max_size=_env_int('HTTP_CACHE_MAX_SIZE', DEFAULT_MAX_SIZE),
+            offline=_env_flag('HTTP_CACHE_OFFLINE'),
+        )
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + '.json', base + '.body'
+
+    def _tmp_path(self, path, suffix):
+        # Один url могут одновременно загружать несколько потоков и процессов
+        return f"{path}.{os.getpid()}.{threading.get_ident()}{suffix}"
+
+    def _write_meta(self, meta_path, meta):
+        tmp_path = self._tmp_path(meta_path, '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def lookup(self, url):
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url or not os.path.exists(body_path):
+            return None
+        return meta
+
+    def age(self, meta):
+        return time.time() - meta.get('fetched_at', 0)
+
+    def is_fresh(self, meta):
+        return self.age(meta) <= self.max_age
+
+    def is_usable_stale(self, meta):
+        return self.age(meta) <= self.max_stale
+
+    def conditional_headers(self, meta):
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def open_body(self, url):
+        # Файл с телом из кэша с отметкой об использовании для LRU
+        meta = self.lookup(url)
+        if meta is None:
+            raise CacheMiss(url)
+        meta_path, body_path = self._paths(url)
+        meta['used_at'] = time.time()
+        self._write_meta(meta_path, meta)
+        return open(body_path, 'rb')
+
+    def read(self, url):
+        with self.open_body(url) as f:
+            return f.read()
+
+    def body_digest(self, url):
+        # sha256 тела; для записей без него считается один раз и сохраняется
+        meta = self.lookup(url)
+        if meta is None:
+            raise CacheMiss(url)
+        if not meta.get('sha256'):
+            h = hashlib.sha256()
+            with open(self._paths(url)[1], 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    h.update(chunk)
+            meta['sha256'] = h.hexdigest()
+            self._write_meta(self._paths(url)[0], meta)
+        return meta['sha256']
+
+    def mark_revalidated(self, url, headers):
+        # Ответ 304: обновляем валидаторы и время загрузки
+        meta = self.lookup(url)
+        if meta is None:
+            raise CacheMiss(url)
+        self._update_validators(meta, headers)
+        meta['fetched_at'] = time.time()
+        self._write_meta(self._paths(url)[0], meta)
+
+    def revalidated(self, url, headers):
+        self.mark_revalidated(url, headers)
+        return self.read(url)
+
+    def _update_validators(self, meta, headers):
+        if headers.get('ETag'):
+            meta['etag'] = headers['ETag']
+        if headers.get('Last-Modified'):
+            meta['last_modified'] = headers['Last-Modified']
+
+    def writer(self, url):
+        return CacheWriter(self, url)
+
+    def store(self, url, body, headers):
+        writer = self.writer(url)
+        writer.write(body)
+        writer.commit(headers)
+
+    def _commit(self, url, tmp_path, size, sha256, headers):
+        meta_path, body_path = self._paths(url)
+        os.replace(tmp_path, body_path)
+
+        now = time.time()
+        meta = {'url': url, 'size': size, 'sha256': sha256, 'fetched_at': now, 'used_at': now}
+        self._update_validators(meta, headers)
+        self._write_meta(meta_path, meta)
+        self._schedule_evict()
+
+    def _schedule_evict(self):
+        with self._lock:
+            if self._evict_scheduled:
+                return
+            self._evict_scheduled = True
+        atexit.register(self.evict)
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            meta_path = os.path.join(self.cache_dir, name)
+            try:
+                with open(meta_path, encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            total += meta.get('size', 0)
+            entries.append((meta.get('used_at', 0), meta_path, meta.get('size', 0)))
+
+        entries.sort()
+        for _, meta_path, size in entries:
+            if total <= self.max_size:
+                break
+            for path in (meta_path, meta_path[:-len('.json')] + '.body'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+
+class CacheWriter:
+    # Потоковая запись тела ответа; в кэш попадает только после commit()
+
+    def __init__(self, cache, url):
+        self.cache = cache
+        self.url = url
+        self.size = 0
+        self.tmp_path = cache._tmp_path(cache._paths(url)[1], '.part')
+        self._file = open(self.tmp_path, 'wb')
+        self._hash = hashlib.sha256()
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self, headers):
+        self._file.close()
+        self.cache._commit(self.url, self.tmp_path, self.size, self._hash.hexdigest(), headers)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+class LineSplitter:
+    # Инкрементальное декодирование UTF-8 и разбиение на строки по мере поступления байтов
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._tail = ''
+
+    def feed(self, chunk):
+        text = self._tail + self._decoder.decode(chunk)
+        lines = text.splitlines()
+        if lines and not text.endswith(('\n', '\r')):
+            self._tail = lines.pop()
+        else:
+            self._tail = ''
+        return lines
+
+    def close(self):
+        text = self._tail + self._decoder.decode(b'', final=True)
+        self._tail = ''
+        return text.splitlines()
+
+
+_default_cache = None
+
+
+def get_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = HttpCache.from_env()
+    return _default_cache
+
+
+def _cached_or_raise(cache, url, error, read=True):
+    meta = cache.lookup(url)
+    if meta is not None and cache.is_usable_stale(meta):
+        print(f"Using cached copy of {url}: {error}")
+        return cache.read(url) if read else None
+    raise error
+
+
+async def fetch_bytes(session, url, params=None, timeout=None, cache=None):
+    import aiohttp
+
+    cache = cache or get_cache()
+    url = cache_url(url, params)
+    meta = cache.lookup(url)
+    if cache.offline or (meta is not None and cache.is_fresh(meta)):
+        return cache.read(url)
+
+    kwargs = {'headers': cache.conditional_headers(meta)}
+    if timeout is not None:
+        kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+    try:
+        async with session.get(url, **kwargs) as response:
+            if response.status == 304 and meta is not None:
+                return cache.revalidated(url, response.headers)
+            response.raise_for_status()
+            body = await response.read()
+            cache.store(url, body, response.headers)
+            return body
+    except Exception as e:
+        return _cached_or_raise(cache, url, e)
+
+
+def fetch_file_sync(url, path, params=None, timeout=None, cache=None, chunk_size=CHUNK_SIZE):
+    # Синхронная загрузка в файл: тело потоково пишется в кэш и копируется в path
+    import requests
+
+    cache = cache or get_cache()
+    url = cache_url(url, params)
+    meta = cache.lookup(url)
+    if not cache.offline and (meta is None or not cache.is_fresh(meta)):
+        try:
+            with requests.get(url, headers=cache.conditional_headers(meta),
+                              timeout=timeout, stream=True) as response:
+                if response.status_code == 304 and meta is not None:
+                    cache.mark_revalidated(url, response.headers)
+                else:
+                    response.raise_for_status()
+                    writer = cache.writer(url)
+                    try:
+                        for chunk in response.iter_content(chunk_size):
+                            writer.write(chunk)
+                    except BaseException:
+                        writer.abort()
+                        raise
+                    writer.commit(response.headers)
+        except Exception as e:
+            _cached_or_raise(cache, url, e, read=False)
+
+    with cache.open_body(url) as src, open(path, 'wb') as dst:
+        shutil.copyfileobj(src, dst, chunk_size)
+
+
+async def refresh(session, url, params=None, timeout=None, cache=None, chunk_size=CHUNK_SIZE):
+    # Обновляет копию url в кэше условным запросом, не разбирая тело.
+    # Возвращает sha256 тела или None, если ни свежей, ни допустимой старой копии нет
+    import aiohttp
+
+    cache = cache or get_cache()
+    url = cache_url(url, params)
+    meta = cache.lookup(url)
+    if cache.offline or (meta is not None and cache.is_fresh(meta)):
+        return cache.body_digest(url) if meta is not None else None
+
+    kwargs = {'headers': cache.conditional_headers(meta)}
+    if timeout is not None:
+        kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+    try:
+        async with session.get(url, **kwargs) as response:
+            if response.status == 304 and meta is not None:
+                cache.mark_revalidated(url, response.headers)
+            else:
+                response.raise_for_status()
+                writer = cache.writer(url)
+                try:
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        writer.write(chunk)
+                except BaseException:
+                    writer.abort()
+                    raise
+                writer.commit(response.headers)
+    except Exception as e:
+        try:
+            _cached_or_raise(cache, url, e, read=False)
+        except Exception:
+            return None
+    return cache.body_digest(url)
+
+
+def cached_lines(url, params=None, cache=None, chunk_size=CHUNK_SIZE):
+    # Пачки строк тела из кэша (после refresh)
+    cache = cache or get_cache()
+    return _cached_line_batches(cache, cache_url(url, params), chunk_size)
+
+
+def _cached_line_batches(cache, url, chunk_size):
+    splitter = LineSplitter()
+    with cache.open_body(url) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            lines = splitter.feed(chunk)
+            if lines:
+                yield lines
+    lines = splitter.close()
+    if lines:
+        yield lines
+
+
+def stream_lines_sync(url, params=None, timeout=None, cache=None, chunk_size=CHUNK_SIZE):
+    import requests
+
+    cache = cache or get_cache()
+    url = cache_url(url, params)
+    meta = cache.lookup(url)
+    if cache.offline or (meta is not None and cache.is_fresh(meta)):
+        yield from _cached_line_batches(cache, url, chunk_size)
+        return
+
+    streamed = False
+    try:
+        with requests.get(url, headers=cache.conditional_headers(meta),
+                          timeout=timeout, stream=True) as response:
+            if response.status_code == 304 and meta is not None:
+                cache.mark_revalidated(url, response.headers)
+            else:
+                response.raise_for_status()
+                writer = cache.writer(url)
+                splitter = LineSplitter()
+                try:
+                    for chunk in response.iter_content(chunk_size):
+                        writer.write(chunk)
+                        lines = splitter.feed(chunk)
+                        if lines:
+                            streamed = True
+                            yield lines
+                    lines = splitter.close()
+                    if lines:
+                        streamed = True
+                        yield lines
+                except BaseException:
+                    writer.abort()
+                    raise
+                writer.commit(response.headers)
+                return
+    except Exception as e:
+        if streamed:
+            raise
+        _cached_or_raise(cache, url, e, read=False)
+
+    yield from _cached_line_batches(cache, url, chunk_size)
+
+
+def decode(body):
+    return body.decode('utf-8', errors='replace')
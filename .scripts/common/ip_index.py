@@ -0,0 +1,239 @@
+# Индекс "адрес -> сервисы" по спискам categories/CIDRs/CIDR{4,6}/services.
+#
+# Все интервалы семейства разбиваются на непересекающиеся отрезки, и каждому
+# отрезку сопоставляется набор сервисов, которые его покрывают. Поиск - один
+# двоичный поиск по отсортированному массиву начал отрезков.
+#
+# Индекс сохраняется в компактный двоичный файл: начала отрезков IPv4 как
+# uint32, IPv6 как 16 байт big-endian, номера наборов как int32. При загрузке
+# массивы не разбираются построчно, поэтому она занимает миллисекунды.
+import os
+import sys
+import struct
+import ipaddress
+from array import array
+from bisect import bisect_right
+
+from common.cidr_merge import V4_BITS, V6_BITS, parse_v4, parse_v6
+
+MAGIC = b'IPIX'
+INDEX_VERSION = 1
+CIDRS_DIR = 'categories/CIDRs'
+FAMILY_DIRS = (('CIDR4', parse_v4, V4_BITS), ('CIDR6', parse_v6, V6_BITS))
+_HEADER = struct.Struct('<4sHIIII')
+NO_SET = -1
+
+
+def _little_endian(arr):
+    if sys.byteorder != 'little':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _from_little_endian(typecode, data):
+    arr = array(typecode)
+    arr.frombytes(data)
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return arr
+
+
+class _Starts16:
+    # Последовательность 16-байтовых начал отрезков IPv6 поверх bytes,
+    # сравнение байтов big-endian совпадает с числовым
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data) // 16
+
+    def __getitem__(self, i):
+        return self.data[i * 16:(i + 1) * 16]
+
+
+def _segments(intervals, bits, set_ids):
+    # intervals: (start, end, service_id); возвращает начала отрезков и номера наборов
+    events = {}
+    for start, end, service_id in intervals:
+        events.setdefault(start, []).append((service_id, 1))
+        events.setdefault(end + 1, []).append((service_id, -1))
+
+    limit = 1 << bits
+    active = {}
+    starts = []
+    segment_sets = []
+    for point in sorted(events):
+        for service_id, delta in events[point]:
+            count = active.get(service_id, 0) + delta
+            if count:
+                active[service_id] = count
+            else:
+                active.pop(service_id, None)
+        if point >= limit:
+            break
+        key = tuple(sorted(active))
+        set_id = set_ids.setdefault(key, len(set_ids)) if key else NO_SET
+        if segment_sets and segment_sets[-1] == set_id:
+            continue
+        if not segment_sets and set_id == NO_SET:
+            continue
+        starts.append(point)
+        segment_sets.append(set_id)
+    return starts, segment_sets
+
+
+class IpIndex:
+    def __init__(self, services, sets, v4_starts, v4_sets, v6_starts, v6_sets):
+        self.services = services
+        self.sets = sets
+        self.v4_starts = v4_starts
+        self.v4_sets = v4_sets
+        self.v6_starts = v6_starts
+        self.v6_sets = v6_sets
+
+    @classmethod
+    def build(cls, root=CIDRS_DIR):
+        services = sorted({
+            name
+            for family, _, _ in FAMILY_DIRS
+            if os.path.isdir(os.path.join(root, family, 'services'))
+            for name in os.listdir(os.path.join(root, family, 'services'))
+        })
+        service_ids = {name: i for i, name in enumerate(services)}
+        set_ids = {}
+        families = []
+        for family, parse, bits in FAMILY_DIRS:
+            intervals = []
+            for path in list_files(root, family):
+                service_id = service_ids[os.path.basename(os.path.dirname(path))]
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            start, end = parse(line)
+                        except ValueError:
+                            continue
+                        intervals.append((start, end, service_id))
+            families.append(_segments(intervals, bits, set_ids))
+
+        sets = [None] * len(set_ids)
+        for key, set_id in set_ids.items():
+            sets[set_id] = tuple(services[i] for i in key)
+
+        (v4_starts, v4_sets), (v6_starts, v6_sets) = families
+        return cls(
+            services, sets,
+            array('I', v4_starts), array('i', v4_sets),
+            _Starts16(b''.join(start.to_bytes(16, 'big') for start in v6_starts)), array('i', v6_sets),
+        )
+
+    def save(self, path):
+        names = '\n'.join(self.services).encode('utf-8')
+        set_members = array('H')
+        set_sizes = array('H')
+        service_ids = {name: i for i, name in enumerate(self.services)}
+        for members in self.sets:
+            set_sizes.append(len(members))
+            set_members.extend(service_ids[name] for name in members)
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, INDEX_VERSION, len(names), len(self.sets),
+                                 len(self.v4_starts), len(self.v6_sets)))
+            f.write(names)
+            f.write(struct.pack('<I', len(set_members)))
+            f.write(_little_endian(set_sizes))
+            f.write(_little_endian(set_members))
+            f.write(_little_endian(self.v4_starts))
+            f.write(_little_endian(self.v4_sets))
+            f.write(self.v6_starts.data)
+            f.write(_little_endian(self.v6_sets))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, names_size, n_sets, n_v4, n_v6 = _HEADER.unpack_from(data)
+        if magic != MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"{path}: unsupported index format")
+
+        view = memoryview(data)
+        pos = _HEADER.size
+
+        def take(size):
+            nonlocal pos
+            chunk = view[pos:pos + size]
+            pos += size
+            return chunk
+
+        services = bytes(take(names_size)).decode('utf-8').split('\n') if names_size else []
+        n_members, = struct.unpack('<I', take(4))
+        set_sizes = _from_little_endian('H', take(2 * n_sets))
+        set_members = _from_little_endian('H', take(2 * n_members))
+        sets = []
+        offset = 0
+        for size in set_sizes:
+            sets.append(tuple(services[i] for i in set_members[offset:offset + size]))
+            offset += size
+
+        v4_starts = _from_little_endian('I', take(4 * n_v4))
+        v4_sets = _from_little_endian('i', take(4 * n_v4))
+        v6_starts = _Starts16(bytes(take(16 * n_v6)))
+        v6_sets = _from_little_endian('i', take(4 * n_v6))
+        return cls(services, sets, v4_starts, v4_sets, v6_starts, v6_sets)
+
+    def lookup(self, address):
+        # Сервисы, списки которых покрывают адрес (строка или ip_address)
+        if isinstance(address, str):
+            address = ipaddress.ip_address(address.strip())
+        if address.version == 4:
+            starts, segment_sets, key = self.v4_starts, self.v4_sets, int(address)
+        else:
+            starts, segment_sets, key = self.v6_starts, self.v6_sets, address.packed
+        i = bisect_right(starts, key) - 1
+        if i < 0 or segment_sets[i] == NO_SET:
+            return ()
+        return self.sets[segment_sets[i]]
+
+    def lookup_many(self, addresses):
+        return [self.lookup(address) for address in addresses]
+
+
+def list_files(root, family):
+    services_dir = os.path.join(root, family, 'services')
+    if not os.path.isdir(services_dir):
+        return []
+    paths = []
+    for name in sorted(os.listdir(services_dir)):
+        service_dir = os.path.join(services_dir, name)
+        if os.path.isdir(service_dir):
+            paths.extend(
+                os.path.join(service_dir, file_name)
+                for file_name in sorted(os.listdir(service_dir))
+                if file_name.endswith('.lst')
+            )
+    return paths
+
+
+def load_index(path, root=CIDRS_DIR):
+    # Готовый индекс из файла, если он новее всех списков, иначе - пересборка
+    # Каталоги тоже проверяются: удаление списка меняет mtime каталога сервиса
+    lists = [p for family, _, _ in FAMILY_DIRS for p in list_files(root, family)]
+    lists += {os.path.dirname(p) for p in lists}
+    if os.path.exists(path):
+        index_mtime = os.path.getmtime(path)
+        if all(os.path.getmtime(p) <= index_mtime for p in lists):
+            try:
+                return IpIndex.load(path)
+            except (ValueError, struct.error):
+                pass
+    index = IpIndex.build(root)
+    index.save(path)
+    return index
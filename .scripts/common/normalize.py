@@ -0,0 +1,105 @@
+# Нормализация строк со списками доменов.
+#
+# Понимает голые домены, URL, строки hosts (IP и один или несколько доменов),
+# правила AdBlock (||domain^), правила v2fly (full:/domain:/keyword:,
+# атрибуты @attr) и маски вида *.domain.
+# Все выражения компилируются один раз при импорте.
+import re
+
+_BARE_DOMAIN_RE = re.compile(r'[a-z0-9-]+(?:\.[a-z0-9-]+)+')
+_DOMAIN_RE = re.compile(r'[\w-]+(?:\.[\w-]+)+')
+_LABEL_RE = re.compile(r'[\w-]+(?:\.[\w-]+)*')
+_IPV4_RE = re.compile(r'(?:(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)\.){3}'
+                      r'(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)')
+# Итоговая проверка домена для блок-листов
+DOMAIN_REGEX = re.compile(r'^([a-zA-Z0-9-]+\.)*[a-zA-Z0-9-]+\.[a-zA-Z]{2,}$')
+
+_LIST_PREFIX_RE = re.compile(r'^-\s*')
+_COMMENT_RE = re.compile(r'^(?:;|//|--|!|@@|\[)')
+# Любой адрес в начале строки hosts: 0.0.0.0, 127.0.0.1, 192.168.1.1, ::1 и т.п.
+_HOSTS_PREFIX_RE = re.compile(r'^(?:[0-9.]+|[0-9a-f]*:[0-9a-f:.]*)\s+', re.IGNORECASE)
+# ||domain^ без модификаторов
+_ADBLOCK_RE = re.compile(r'\|\|([^\s^$/|*]+)\^\|?')
+_RULE_PREFIX_RE = re.compile(r'^(?:full:|domain:|keyword:|\*\.?)')
+_SCHEME_RE = re.compile(r'^(?:https?:)?//', re.IGNORECASE)
+_WWW_RE = re.compile(r'^www\d*\.', re.IGNORECASE)
+_TAIL_RE = re.compile(r'[/:?\s].*$', re.DOTALL)
+
+REGEXP_PREFIX = 'regexp:'
+
+
+def is_ipv4(value):
+    return _IPV4_RE.fullmatch(value) is not None
+
+
+def _clean(line, single_label):
+    # line уже без комментария и префикса hosts
+    if line.startswith('||'):
+        match = _ADBLOCK_RE.fullmatch(line)
+        if not match:
+            return None
+        line = match.group(1)
+    line = _RULE_PREFIX_RE.sub('', line)
+    line = line.split('@', 1)[0].strip()
+    line = _SCHEME_RE.sub('', line)
+    line = _WWW_RE.sub('', line)
+    line = _TAIL_RE.sub('', line).rstrip('.').lower()
+    valid = _LABEL_RE if single_label else _DOMAIN_RE
+    if not valid.fullmatch(line):
+        return None
+    return line
+
+
+def _strip_line(line):
+    line = line.split('#', 1)[0].strip()
+    if not line or _COMMENT_RE.match(line):
+        return None
+    return _LIST_PREFIX_RE.sub('', line)
+
+
+def normalize_line(line, single_label=False):
+    # Один домен из строки; для строк hosts - первый домен после адреса.
+    # single_label разрешает записи без точки (ua, local)
+    if _BARE_DOMAIN_RE.fullmatch(line) and not line.startswith('www'):
+        return line
+    entries = normalize_entries(line, single_label)
+    return entries[0] if entries else None
+
+
+def normalize_entries(line, single_label=False):
+    # Все домены строки: строка hosts может перечислять несколько имен
+    if _BARE_DOMAIN_RE.fullmatch(line) and not line.startswith('www'):
+        return [line]
+    line = _strip_line(line)
+    if not line:
+        return []
+    hosts = _HOSTS_PREFIX_RE.sub('', line, count=1)
+    if hosts != line:
+        entries = []
+        for token in hosts.split():
+            domain = _clean(token, single_label)
+            if domain:
+                entries.append(domain)
+        return entries
+    domain = _clean(line, single_label)
+    return [domain] if domain else []
+
+
+def normalize_lines(lines, expand_regexp=None, single_label=False):
+    domains = set()
+    for line in lines:
+        if _BARE_DOMAIN_RE.fullmatch(line) and not line.startswith('www'):
+            domains.add(line)
+            continue
+        if expand_regexp is not None:
+            stripped = line.split('#', 1)[0].strip()
+            if stripped.startswith(REGEXP_PREFIX):
+                domains.update(expand_regexp(stripped[len(REGEXP_PREFIX):].strip()))
+                continue
+        domains.update(normalize_entries(line, single_label))
+    return domains
+
+
+def normalize_text(text, expand_regexp=None, single_label=False):
+    # Пакетная нормализация целого скачанного файла
+    return normalize_lines(text.splitlines(), expand_regexp, single_label)
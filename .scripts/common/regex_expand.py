@@ -0,0 +1,230 @@
+# Перечисление доменов, которые описывает правило regexp:.
+#
+# Выражение разбирается стандартным парсером re, после чего дерево разбора
+# обходится с ограничением на число вариантов и время на один шаблон.
+# Бесконечные (или слишком широкие) шаблоны не угадываются, а отклоняются
+# с указанием причины. Единственное допущение - необязательный префикс из
+# любых меток: ^(.+\.)?example\.com$ совпадает ровно с example.com и всеми его
+# поддоменами, то есть с суффиксом example.com в списке доменов. Обязательный
+# префикс (^.+\.example\.com$, ^[^.]+\.cdn\.com$) с самим родителем не
+# совпадает, поэтому такие шаблоны отклоняются, а не заменяются суффиксом.
+#
+# Результаты кэшируются на диске по строке шаблона. Отказ по времени зависит
+# от машины и нагрузки, поэтому в кэш не попадает. expand можно вызывать из
+# нескольких потоков: шаблоны раскрываются по одному.
+import os
+import re
+import json
+import time
+import threading
+
+try:
+    import re._parser as sre_parse
+    import re._constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+CACHE_VERSION = 3
+DEFAULT_MAX_VARIANTS = 1000
+DEFAULT_TIME_LIMIT = 0.5
+
+_VALID_DOMAIN_RE = re.compile(r'[a-z0-9-]+(?:\.[a-z0-9-]+)+')
+_DOT = ord('.')
+_ANCHORS_BEGIN = (sre_constants.AT_BEGINNING, sre_constants.AT_BEGINNING_STRING)
+_ANCHORS_END = (sre_constants.AT_END, sre_constants.AT_END_STRING)
+_REPEATS = tuple(
+    getattr(sre_constants, name)
+    for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+    if hasattr(sre_constants, name)
+)
+
+
+class RegexExpansionError(Exception):
+    pass
+
+
+class RegexTimeoutError(RegexExpansionError):
+    pass
+
+
+class RegexExpander:
+    def __init__(self, cache_path=None, max_variants=DEFAULT_MAX_VARIANTS,
+                 time_limit=DEFAULT_TIME_LIMIT):
+        self.cache_path = cache_path
+        self.max_variants = max_variants
+        self.time_limit = time_limit
+        self.rejected = {}
+        self._cache = {}
+        self._timeouts = {}
+        self._dirty = False
+        self._deadline = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def _cache_key(self):
+        return f"{CACHE_VERSION}:{self.max_variants}"
+
+    def _load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('key') == self._cache_key():
+            self._cache = data.get('patterns', {})
+
+    def save(self):
+        if not self.cache_path or not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'key': self._cache_key(), 'patterns': self._cache}, f)
+        os.replace(tmp_path, self.cache_path)
+        self._dirty = False
+
+    def expand(self, pattern):
+        with self._lock:
+            return self._expand(pattern.strip())
+
+    def _expand(self, pattern):
+        cached = self._cache.get(pattern) or self._timeouts.get(pattern)
+        if cached is None:
+            try:
+                cached = {'domains': sorted(self.enumerate(pattern))}
+            except RegexTimeoutError as e:
+                # Только на время запуска
+                cached = self._timeouts[pattern] = {'error': str(e)}
+            except RegexExpansionError as e:
+                cached = {'error': str(e)}
+            if pattern not in self._timeouts:
+                self._cache[pattern] = cached
+                self._dirty = True
+
+        if 'error' in cached:
+            if pattern not in self.rejected:
+                self.rejected[pattern] = cached['error']
+                print(f"Warning: regexp '{pattern}' skipped: {cached['error']}")
+            return []
+        return cached['domains']
+
+    def timed_out(self, pattern):
+        # Шаблон отклонен по времени в этом запуске: результат с ним неполон
+        return pattern.strip() in self._timeouts
+
+    def enumerate(self, pattern):
+        try:
+            items = list(sre_parse.parse(pattern))
+        except re.error as e:
+            raise RegexExpansionError(f"invalid pattern ({e})")
+
+        if not items or items[0][0] != sre_constants.AT or items[0][1] not in _ANCHORS_BEGIN:
+            raise RegexExpansionError("pattern is not anchored with ^")
+        if items[-1][0] != sre_constants.AT or items[-1][1] not in _ANCHORS_END:
+            raise RegexExpansionError("pattern is not anchored with $")
+        items = items[1:-1]
+
+        self._deadline = time.monotonic() + self.time_limit
+        if items and self._is_unbounded(items[0]):
+            if not self._is_suffix_prefix(items[0]):
+                raise RegexExpansionError("unbounded prefix other than (.+\\.)?")
+            items = items[1:]
+
+        domains = set()
+        for variant in self._expand_sequence(items):
+            variant = variant.strip('.').lower()
+            if _VALID_DOMAIN_RE.fullmatch(variant):
+                domains.add(variant)
+        if not domains:
+            raise RegexExpansionError("no concrete domains")
+        return domains
+
+    def _check(self, count):
+        if count > self.max_variants:
+            raise RegexExpansionError(f"more than {self.max_variants} variants")
+        if time.monotonic() > self._deadline:
+            raise RegexTimeoutError(f"expansion took longer than {self.time_limit}s")
+
+    def _is_unbounded(self, item):
+        op, av = item
+        if op in _REPEATS:
+            return av[1] == sre_constants.MAXREPEAT or any(self._is_unbounded(i) for i in av[2])
+        if op == sre_constants.SUBPATTERN:
+            return any(self._is_unbounded(i) for i in av[-1])
+        if op == sre_constants.BRANCH:
+            return any(self._is_unbounded(i) for seq in av[1] for i in seq)
+        return False
+
+    def _is_suffix_prefix(self, item):
+        # (.+\.)? или (.*\.)*: пустая строка либо любые метки с точкой на конце
+        op, av = item
+        if op not in _REPEATS or av[0] != 0:
+            return False
+        seq = list(av[2])
+        while len(seq) == 1 and seq[0][0] == sre_constants.SUBPATTERN:
+            seq = list(seq[0][1][-1])
+        if len(seq) != 2 or seq[1] != (sre_constants.LITERAL, _DOT) or seq[0][0] not in _REPEATS:
+            return False
+        low, high, body = seq[0][1]
+        return low <= 1 and high == sre_constants.MAXREPEAT and \
+            [op for op, _ in body] == [sre_constants.ANY]
+
+    def _expand_sequence(self, items):
+        results = ['']
+        for item in items:
+            part = self._expand_item(item)
+            self._check(len(results) * len(part))
+            results = [a + b for a in results for b in part]
+        return results
+
+    def _expand_item(self, item):
+        op, av = item
+        if op == sre_constants.LITERAL:
+            return [chr(av)]
+        if op == sre_constants.IN:
+            return self._expand_class(av)
+        if op == sre_constants.BRANCH:
+            variants = []
+            for seq in av[1]:
+                variants.extend(self._expand_sequence(seq))
+                self._check(len(variants))
+            return variants
+        if op == sre_constants.SUBPATTERN:
+            return self._expand_sequence(av[-1])
+        if op in _REPEATS:
+            low, high, seq = av
+            if high == sre_constants.MAXREPEAT:
+                raise RegexExpansionError("unbounded repetition")
+            base = self._expand_sequence(seq)
+            variants = []
+            current = ['']
+            for count in range(high + 1):
+                if count >= low:
+                    variants.extend(current)
+                    self._check(len(variants))
+                if count < high:
+                    self._check(len(current) * len(base))
+                    current = [a + b for a in current for b in base]
+            return variants
+        if op == sre_constants.AT:
+            raise RegexExpansionError("anchor inside the pattern")
+        if op in (sre_constants.ANY, sre_constants.NOT_LITERAL):
+            raise RegexExpansionError("wildcard character")
+        raise RegexExpansionError(f"unsupported construct {op}")
+
+    def _expand_class(self, members):
+        chars = set()
+        for op, av in members:
+            if op == sre_constants.LITERAL:
+                chars.add(chr(av))
+            elif op == sre_constants.RANGE:
+                chars.update(chr(c) for c in range(av[0], av[1] + 1))
+            elif op == sre_constants.CATEGORY and av == sre_constants.CATEGORY_DIGIT:
+                chars.update('0123456789')
+            else:
+                raise RegexExpansionError("unsupported character class")
+        self._check(len(chars))
+        return sorted(chars)
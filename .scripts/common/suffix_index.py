@@ -0,0 +1,98 @@
+# Индекс доменов по суффиксам меток.
+#
+# Вместо попарного сравнения через endswith каждый домен проверяется
+# по своим родительским суффиксам ("a.b.c" -> "b.c" -> "c") в хеш-множестве,
+# поэтому стоимость проверки зависит только от глубины домена.
+
+
+def iter_parents(domain):
+    i = domain.find('.')
+    while i != -1:
+        yield domain[i + 1:]
+        i = domain.find('.', i + 1)
+
+
+class SuffixIndex:
+    def __init__(self, domains=()):
+        self.domains = set(domains)
+
+    def __len__(self):
+        return len(self.domains)
+
+    def __contains__(self, domain):
+        return domain in self.domains
+
+    def add(self, domain):
+        self.domains.add(domain)
+
+    def update(self, domains):
+        self.domains.update(domains)
+
+    def parent_of(self, domain):
+        # Ближайший родитель domain, присутствующий в индексе
+        for parent in iter_parents(domain):
+            if parent in self.domains:
+                return parent
+        return None
+
+    def match(self, domain):
+        # Сам домен или его родитель из индекса
+        if domain in self.domains:
+            return domain
+        return self.parent_of(domain)
+
+    def covers(self, domain):
+        return self.match(domain) is not None
+
+    def collapse(self):
+        # Оставляем только домены, у которых нет родителя в индексе
+        return [d for d in self.domains if self.parent_of(d) is None]
+
+
+def collapse_subdomains(domains):
+    return SuffixIndex(domains).collapse()
+
+
+EXACT = 'exact'
+DESCENDANT = 'descendant'
+ANCESTOR = 'ancestor'
+
+
+class ExclusionIndex:
+    # Отвечает, является ли домен исключенным, его поддоменом (descendant)
+    # или родителем исключенного домена (ancestor).
+
+    def __init__(self, domains=()):
+        self.excluded = SuffixIndex()
+        self.ancestors = set()
+        self.update(domains)
+
+    def __len__(self):
+        return len(self.excluded)
+
+    def update(self, domains):
+        for domain in domains:
+            if domain in self.excluded:
+                continue
+            self.excluded.add(domain)
+            self.ancestors.update(iter_parents(domain))
+
+    def relation(self, domain):
+        if domain in self.excluded:
+            return EXACT
+        if self.excluded.parent_of(domain) is not None:
+            return DESCENDANT
+        if domain in self.ancestors:
+            return ANCESTOR
+        return None
+
+    def is_excluded(self, domain, ancestors=True):
+        if self.excluded.covers(domain):
+            return True
+        return ancestors and domain in self.ancestors
+
+    def filter(self, domains, ancestors=True):
+        # Пакетная версия is_excluded: возвращает неисключенные домены
+        if not self.excluded:
+            return set(domains)
+        return {d for d in domains if not self.is_excluded(d, ancestors)}
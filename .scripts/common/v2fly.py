@@ -0,0 +1,144 @@
+# Разбор файлов data/ из v2fly/domain-list-community.
+#
+# Каждый файл читается и разбирается один раз. Включения (include:) образуют
+# граф, результат разрешения каждого узла запоминается. Атрибуты @attr
+# сохраняются, поэтому include:name @attr и include:name @-attr фильтруют уже
+# разрешенные записи без повторного разбора.
+import os
+
+from common.normalize import normalize_line
+
+INCLUDE_PREFIX = 'include:'
+REGEXP_PREFIX = 'regexp:'
+
+
+class V2flyFile:
+    __slots__ = ('entries', 'includes', 'regexps')
+
+    def __init__(self, entries, includes, regexps):
+        # entries: множество (domain, frozenset(attrs))
+        # includes: список (name, обязательные атрибуты, запрещенные атрибуты)
+        # regexps: шаблоны regexp: этого файла
+        self.entries = entries
+        self.includes = includes
+        self.regexps = regexps
+
+
+def parse_rule_line(line):
+    line = line.split('#', 1)[0].strip()
+    if not line:
+        return None, frozenset()
+    parts = line.split()
+    attrs = frozenset(part[1:] for part in parts[1:] if part.startswith('@'))
+    return parts[0], attrs
+
+
+def attrs_match(attrs, required, excluded):
+    return required <= attrs and not (excluded & attrs)
+
+
+class V2flyResolver:
+    def __init__(self, data_dir, expand_regexp=None):
+        self.data_dir = data_dir
+        self.expand_regexp = expand_regexp
+        self._files = {}
+        self._resolved = {}
+        self._domains = {}
+        self._resolving = {}
+
+    def parse_file(self, name):
+        if name in self._files:
+            return self._files[name]
+
+        parsed = None
+        path = os.path.join(self.data_dir, name)
+        if os.path.isfile(path):
+            entries = set()
+            includes = []
+            regexps = []
+            with open(path, 'r', encoding='utf-8') as f:
+                for raw_line in f:
+                    rule, attrs = parse_rule_line(raw_line)
+                    if not rule:
+                        continue
+                    if rule.startswith(INCLUDE_PREFIX):
+                        required = frozenset(a for a in attrs if not a.startswith('-'))
+                        excluded = frozenset(a[1:] for a in attrs if a.startswith('-'))
+                        includes.append((rule[len(INCLUDE_PREFIX):], required, excluded))
+                    elif rule.startswith(REGEXP_PREFIX):
+                        regexps.append(rule[len(REGEXP_PREFIX):])
+                        if self.expand_regexp is not None:
+                            for domain in self.expand_regexp(regexps[-1]):
+                                entries.add((domain, attrs))
+                    else:
+                        domain = normalize_line(rule)
+                        if domain:
+                            entries.add((domain, attrs))
+            parsed = V2flyFile(entries, includes, regexps)
+
+        self._files[name] = parsed
+        return parsed
+
+    def resolve(self, name):
+        # Все записи файла с учетом включений: frozenset((domain, attrs))
+        return self._resolve(name)[0]
+
+    def _resolve(self, name):
+        # Возвращает (записи, глубина самого верхнего узла стека, на который
+        # сослались). Узел, зависящий от еще не разрешенного предка по циклу,
+        # не запоминается: его неполный результат пересчитывается позже, когда
+        # предок уже разрешен.
+        if name in self._resolved:
+            return self._resolved[name], None
+        if name in self._resolving:
+            print(f"Warning: v2fly include cycle through '{name}'")
+            return frozenset(), self._resolving[name]
+
+        parsed = self.parse_file(name)
+        if parsed is None:
+            self._resolved[name] = frozenset()
+            return self._resolved[name], None
+
+        depth = len(self._resolving)
+        self._resolving[name] = depth
+        low = None
+        try:
+            entries = set(parsed.entries)
+            for included, required, excluded in parsed.includes:
+                included_entries, included_low = self._resolve(included)
+                if included_low is not None and included_low < depth:
+                    low = included_low if low is None else min(low, included_low)
+                if required or excluded:
+                    included_entries = [
+                        entry for entry in included_entries
+                        if attrs_match(entry[1], required, excluded)
+                    ]
+                entries.update(included_entries)
+        finally:
+            del self._resolving[name]
+
+        entries = frozenset(entries)
+        if low is None:
+            self._resolved[name] = entries
+        return entries, low
+
+    def domains(self, name):
+        if name not in self._domains:
+            self._domains[name] = frozenset(domain for domain, _ in self.resolve(name))
+        return self._domains[name]
+
+    def regexps(self, name):
+        # Шаблоны regexp: файла и всех файлов, которые он включает
+        patterns = set()
+        seen = set()
+        pending = [name]
+        while pending:
+            current = pending.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            parsed = self.parse_file(current)
+            if parsed is not None:
+                patterns.update(parsed.regexps)
+                pending.extend(included for included, _, _ in parsed.includes)
+        return patterns
@@ -0,0 +1,71 @@
+# Производные варианты domains.lst из секции [variants] parsing-domains.toml.
+#
+# Вариант - это domains.lst без доменов перечисленных сервисов и групп
+# (включая их поддомены). Списки всех исключений сводятся в один индекс
+# суффиксов с пометкой варианта, поэтому все варианты считаются за один
+# проход по domains.lst.
+import os
+from collections import namedtuple
+
+from common.domain_index import DomainIndex
+
+try:
+    import tomllib
+except ModuleNotFoundError:
+    import toml as tomllib
+
+CONFIG_PATH = '.scripts/config/parsing-domains.toml'
+SERVICES_DIR = 'categories/Services'
+GROUPS_DIR = 'categories/Groups'
+
+Variant = namedtuple('Variant', ['name', 'exclude', 'output'])
+
+
+def variant_file(name):
+    return f'domains-{name}.lst'
+
+
+def load_variants(config_path=CONFIG_PATH):
+    with open(config_path, 'rb') as f:
+        config = tomllib.loads(f.read().decode('utf-8'))
+    variants = []
+    for name, section in config.get('variants', {}).items():
+        exclude = section.get('exclude', [])
+        if isinstance(exclude, str):
+            exclude = [exclude]
+        variants.append(Variant(name, tuple(exclude), variant_file(name)))
+    return variants
+
+
+def find_list(name):
+    # Список сервиса или группы по имени (без учета регистра)
+    key = name.strip().lower()
+    for base_dir in (SERVICES_DIR, GROUPS_DIR):
+        if not os.path.isdir(base_dir):
+            continue
+        for entry in os.listdir(base_dir):
+            if entry.lower() == key:
+                path = os.path.join(base_dir, entry, f'{entry}.lst')
+                if os.path.exists(path):
+                    return path
+    return None
+
+
+def build_variants(domains, variants, read_list):
+    # {имя варианта: домены из domains в исходном порядке}
+    index = DomainIndex()
+    for variant in variants:
+        for name in variant.exclude:
+            path = find_list(name)
+            if path is None:
+                print(f"Warning: list '{name}' for variant '{variant.name}' not found")
+                continue
+            index.add_source(variant.name, read_list(path))
+
+    results = {variant.name: [] for variant in variants}
+    for domain in domains:
+        excluded = {source for _, source in index.lookup(domain)}
+        for variant in variants:
+            if variant.name not in excluded:
+                results[variant.name].append(domain)
+    return results
@@ -1,15 +1,15 @@
 import json
 import os
+from common.variants import load_variants
 
 DOMAINS_FILE = 'domains.lst'
 CIDR4_FILE = 'categories/CIDRs/CIDR4/summary-cidr4.lst'
 BLOCK_DOMAINS_FILE = 'categories/Block/block-domains.lst'
 BLOCK_IPS_FILE = 'categories/Block/block-ips.lst'
-DOMAINS_WITHOUT_YT_FILE = 'domains-without-yt.lst'
 
 OUTPUT_MAIN = 'categories/Rulesets/sing-box-rules/domains-cidr4.json'
 OUTPUT_BLOCK = 'categories/Rulesets/sing-box-rules/block.json'
-OUTPUT_WITHOUT_YT = 'categories/Rulesets/sing-box-rules/domains-cidr4-without-yt.json'
+OUTPUT_VARIANT = 'categories/Rulesets/sing-box-rules/domains-cidr4-{name}.json'
 
 def read_lines(file_path):
     with open(file_path, 'r', encoding='utf-8') as f:
@@ -44,10 +44,13 @@ def main():
     block_data = create_rules(block_domains, block_ips)
     save_json(block_data, OUTPUT_BLOCK)
 
-    # Ruleset без YouTube
-    domains_without_yt = read_lines(DOMAINS_WITHOUT_YT_FILE)
-    without_yt_data = create_rules(domains_without_yt, cidrs)
-    save_json(without_yt_data, OUTPUT_WITHOUT_YT)
+    # Rulesets производных вариантов (например, без YouTube)
+    for variant in load_variants():
+        if not os.path.exists(variant.output):
+            print(f"{variant.output} не найден")
+            continue
+        variant_data = create_rules(read_lines(variant.output), cidrs)
+        save_json(variant_data, OUTPUT_VARIANT.format(name=variant.name))
 
 if __name__ == "__main__":
     main()
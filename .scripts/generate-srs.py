@@ -6,7 +6,8 @@ import tarfile
 import subprocess
 from pathlib import Path
 
-import requests
+from common.http_cache import fetch_file_sync
+from common.variants import load_variants
 
 # SETTINGS
 SING_BOX_VERSION = os.getenv("SING_BOX_VERSION", "1.11.11")
@@ -21,15 +22,12 @@ CIDR_FILE = Path("categories/CIDRs/CIDR4/summary-cidr4.lst")
 DOMAINS_FILE = Path("domains.lst")
 RULES_JSON = WORK_DIR / "rules.json"
 OUTPUT_SRS = Path("categories/Rulesets/domains-cidr4.srs")
+OUTPUT_VARIANT_SRS = "categories/Rulesets/domains-cidr4-{name}.srs"
 
 
 def download_and_extract():
     print(f"Скачиваем {DOWNLOAD_URL}")
-    resp = requests.get(DOWNLOAD_URL, stream=True)
-    resp.raise_for_status()
-    with open(TARBALL, "wb") as fd:
-        for chunk in resp.iter_content(1024 * 1024):
-            fd.write(chunk)
+    fetch_file_sync(DOWNLOAD_URL, TARBALL)
 
     print(f"Распаковываем {TARBALL}")
     with tarfile.open(TARBALL) as tar:
@@ -40,13 +38,13 @@ def download_and_extract():
         sys.exit(1)
 
 
-def build_rules_json():
-    if not CIDR_FILE.exists() or not DOMAINS_FILE.exists():
-        print("Отсутствуют categories/Rulesets/summary-cidr4.lst или domains.lst", file=sys.stderr)
+def build_rules_json(domains_file=DOMAINS_FILE):
+    if not CIDR_FILE.exists() or not domains_file.exists():
+        print(f"Отсутствуют categories/Rulesets/summary-cidr4.lst или {domains_file}", file=sys.stderr)
         sys.exit(1)
 
-    print("Генерируем rules.json")
-    with open(DOMAINS_FILE) as f:
+    print(f"Генерируем rules.json из {domains_file}")
+    with open(domains_file) as f:
         domains = [d.strip() for d in f if d.strip()]
     with open(CIDR_FILE) as f:
         cidrs = [c.strip() for c in f if c.strip()]
@@ -67,7 +65,7 @@ def build_rules_json():
     with open(RULES_JSON, "w") as f:
         json.dump(payload, f, indent=2)
 
-def compile_srs():
+def compile_srs(output_srs=OUTPUT_SRS):
     bin_path = EXTRACT_DIR / "sing-box"
     if not bin_path.exists():
         print("sing-box бинарь не найден", file=sys.stderr)
@@ -80,10 +78,10 @@ def compile_srs():
         check=True
     )
 
-    os.makedirs(OUTPUT_SRS.parent, exist_ok=True)
+    os.makedirs(output_srs.parent, exist_ok=True)
     if Path("rules.srs").exists():
-        shutil.move("rules.srs", OUTPUT_SRS)
-        print(f"Сгенерирован {OUTPUT_SRS}")
+        shutil.move("rules.srs", output_srs)
+        print(f"Сгенерирован {output_srs}")
     else:
         print("Файл rules.srs не найден", file=sys.stderr)
         sys.exit(1)
@@ -101,6 +99,10 @@ def main():
     download_and_extract()
     build_rules_json()
     compile_srs()
+    # SRS для производных вариантов domains.lst
+    for variant in load_variants():
+        build_rules_json(Path(variant.output))
+        compile_srs(Path(OUTPUT_VARIANT_SRS.format(name=variant.name)))
     cleanup()
 
 
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# Какие списки и источники конфигурации маршрутизируют домены.
+#
+#   python .scripts/lookup-domain.py www.youtube.com discord.gg
+#   python .scripts/lookup-domain.py -f hosts.txt
+import sys
+import argparse
+from common.domain_index import load_index
+from common.normalize import normalize_line
+
+INDEX_FILE = "tmp/domain-index.pickle"
+
+def read_queries(args):
+    if args.domains:
+        return args.domains
+    if args.file:
+        with open(args.file, 'r', encoding='utf-8') as f:
+            return f.read().splitlines()
+    return sys.stdin.read().splitlines()
+
+def main():
+    parser = argparse.ArgumentParser(description="Lookup lists and config sources matching domains")
+    parser.add_argument("domains", nargs="*", help="domains to look up (default: read from stdin)")
+    parser.add_argument("-f", "--file", help="read domains from file, one per line")
+    parser.add_argument("--index", default=INDEX_FILE, help=f"index cache file (default: {INDEX_FILE})")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the index even if it is up to date")
+    args = parser.parse_args()
+
+    index = load_index(args.index, rebuild=args.rebuild)
+
+    # Одна строка на совпадение: запрос, совпавший суффикс, источник
+    out = []
+    for query in read_queries(args):
+        query = query.strip()
+        if not query:
+            continue
+        domain = normalize_line(query.lower())
+        if not domain:
+            print(f"Invalid domain: {query}", file=sys.stderr)
+            continue
+        matches = index.lookup(domain)
+        if not matches:
+            out.append(f"{query}\t-")
+        out.extend(f"{query}\t{suffix}\t{source}" for suffix, source in matches)
+    print("\n".join(out))
+
+if __name__ == "__main__":
+    main()
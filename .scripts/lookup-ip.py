@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# Какие сервисы из categories/CIDRs покрывают адреса.
+#
+#   echo 1.1.1.1 | python .scripts/lookup-ip.py
+#   python .scripts/lookup-ip.py 1.1.1.1 2606:4700::1111
+import sys
+import argparse
+from common.ip_index import CIDRS_DIR, IpIndex, load_index
+
+INDEX_FILE = "tmp/ip-index.bin"
+
+def main():
+    parser = argparse.ArgumentParser(description="Lookup services covering IP addresses")
+    parser.add_argument("addresses", nargs="*", help="addresses to look up (default: read from stdin)")
+    parser.add_argument("--index", default=INDEX_FILE, help=f"index file (default: {INDEX_FILE})")
+    parser.add_argument("--root", default=CIDRS_DIR, help=f"CIDR lists directory (default: {CIDRS_DIR})")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the index even if it is up to date")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        index = IpIndex.build(args.root)
+        index.save(args.index)
+    else:
+        index = load_index(args.index, args.root)
+
+    addresses = args.addresses or (line.strip() for line in sys.stdin)
+    out = []
+    for address in addresses:
+        if not address:
+            continue
+        try:
+            services = index.lookup(address)
+        except ValueError:
+            print(f"Invalid address: {address}", file=sys.stderr)
+            continue
+        out.append(f"{address}\t{','.join(services) if services else '-'}")
+        if len(out) >= 10000:
+            print("\n".join(out))
+            out = []
+    if out:
+        print("\n".join(out))
+
+if __name__ == "__main__":
+    main()
@@ -1,571 +1,551 @@
 #!/usr/bin/env python3
 import os
-import re
+import sys
+import json
 import shutil
 import asyncio
 import aiohttp
+from concurrent.futures import ProcessPoolExecutor
 import aiofiles
-from urllib.parse import urlparse
+from common.build_plan import clean_domains, load_plan
+from common.build_manifest import BuildManifest, digest, hash_domains, hash_file, source_digest
+from common.domain_table import DomainSet, DomainTable
+from common.fetch_registry import FetchRegistry
+from common.http_cache import cached_lines, refresh
+from common.normalize import REGEXP_PREFIX, normalize_line, normalize_lines
+from common.regex_expand import RegexExpander
+from common.suffix_index import ExclusionIndex, collapse_subdomains
+from common.v2fly import V2flyResolver
 try:
     import tomllib
 except ImportError:
     import toml as tomllib
 
-V2FLY_REPO_URL = "https://github.com/v2fly/domain-list-community.git"
-V2FLY_CLONE_DIR = "tmp/domain-list-community"
-V2FLY_DATA_DIR = os.path.join(V2FLY_CLONE_DIR, "data")
+# V2FLY_REPO_URL можно указать на локальный (в т.ч. bare) репозиторий для офлайн-сборки
+V2FLY_REPO_URL = os.getenv("V2FLY_REPO_URL", "https://github.com/v2fly/domain-list-community.git")
+V2FLY_MIRROR_DIR = "tmp/domain-list-community"
+V2FLY_DATA_DIR = os.path.join(V2FLY_MIRROR_DIR, "data")
+V2FLY_CACHE_FILE = "tmp/v2fly-categories.json"
+V2FLY_CACHE_VERSION = 3
+REGEX_CACHE_FILE = "tmp/regex-cache.json"
+BUILD_MANIFEST_FILE = "tmp/build-manifest.json"
+BUILD_PLAN_FILE = "tmp/build-plan.pickle"
+EMPTY_RESULT = "empty"
+# Ключ манифеста с sha256 тела источника на прошлом запуске
+SOURCE_KEY_PREFIX = "source:"
 CONFIG_PATH = ".scripts/config/parsing-domains.toml"
 DOMAINS_FILE = "domains.lst"
 CATEGORIES_DIR = "categories/Services"
 GROUPS_DIR = "categories/Groups"
+DEFAULT_CONNECTION_LIMIT = 32
+DEFAULT_CONNECTION_LIMIT_PER_HOST = 4
+DEFAULT_DNS_CACHE_TTL = 300
+# Таймауты на установку соединения и на чтение, без общего: общий включал бы
+# ожидание свободного соединения в пуле (connection_limit_per_host)
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 10
+DEFAULT_SERVICE_CONCURRENCY = 8
+# Сворачивание 50 тыс. доменов занимает ~120 мс, из них на цикле событий при
+# передаче в процесс остается ~25 мс на pickle. Реальные списки - единицы
+# тысяч доменов (~5 мс), поэтому пул создается только при первой необходимости.
+CPU_OFFLOAD_THRESHOLD = 50000
+CPU_WORKERS = None
+CPU_POOL = None
+# Модули, от кода которых зависит содержимое списков (входят в хеш входных данных)
+CODE_MODULES = ('common.build_plan', 'common.normalize', 'common.regex_expand',
+                'common.suffix_index', 'common.v2fly')
+
+REGEX_EXPANDER = RegexExpander(REGEX_CACHE_FILE)
+BUILD_MANIFEST = BuildManifest(BUILD_MANIFEST_FILE)
 
 def generate_from_regex(regex_pattern):
-    try:
-        regex = regex_pattern.replace('^', '').replace('$', '')
-        regex = re.sub(r'\(([^|]+)\|([^)]+)\)', r'(\1|\2)', regex)
-        parts = []
-        for part in re.split(r'([()|])', regex):
-            if not part or part in '()':
-                continue
-            if part == '|':
-                parts.append('|')
-            else:
-                parts.append(part)
-        variants = [''] if not regex.startswith('|') else []
-        i = 0
-        while i < len(parts):
-            part = parts[i]
-            if part == '|':
-                left = variants.pop()
-                right = parts[i+1]
-                variants.append(f'({left}|{right})')
-                i += 2
-            else:
-                if i+1 < len(parts) and parts[i+1] in ('?', '*', '+', '{'):
-                    quant = parts[i+1]
-                    if quant == '?':
-                        variants = [v + part for v in variants] + variants.copy()
-                    elif quant == '*':
-                        variants = [v + part*2 for v in variants] + [v + part for v in variants] + variants.copy()
-                    elif quant == '+':
-                        variants = [v + part for v in variants] + [v + part*2 for v in variants]
-                    elif quant.startswith('{'):
-                        n = int(re.search(r'\{(\d+)\}', quant).group(1))
-                        variants = [v + part*n for v in variants]
-                    i += 2
-                else:
-                    variants = [v + part for v in variants]
-                    i += 1
-        valid_domains = set()
-        for variant in variants:
-            variant = variant.replace('(', '').replace(')', '').replace('|', '')
-            if '.' in variant and not re.search(r'[^a-z0-9.-]', variant):
-                valid_domains.add(variant)
-        return list(valid_domains)
-    except Exception:
-        return []
+    return REGEX_EXPANDER.expand(regex_pattern)
 
 def clean_domain_line(line):
     line = line.split('#')[0].strip()
     if not line:
         return None
-    if line.startswith('regexp:'):
-        regex = line[7:].strip()
+    if line.startswith(REGEXP_PREFIX):
+        regex = line[len(REGEXP_PREFIX):].strip()
         domains = generate_from_regex(regex)
         return domains if domains else None
-    line = re.sub(r'^\s*-\s*', '', line)
-    line = re.sub(r'^\s*(#|;|//|--).*', '', line)
-    line = re.sub(r'^(full:|domain:|keyword:)', '', line)
-    line = line.split('@')[0]
-    line = re.sub(r'^https?://', '', line)
-    line = re.sub(r'^//', '', line)
-    line = re.sub(r'^www\d*\.', '', line, flags=re.IGNORECASE)
-    line = line.strip()
-    if not line:
-        return None
-    line = re.sub(r'[/:].*$', '', line)
-    if re.search(r"[\\^$*+?()\[\]{}|]", line):
-        return None
-    try:
-        parsed = urlparse('http://' + line)
-        netloc = parsed.netloc.split(':')[0]
-        if not netloc or '.' not in netloc:
-            return None
-        return netloc.lower()
-    except Exception:
-        return None
+    return normalize_line(line)
 
 def filter_domains_list(domains):
     if not domains:
         return []
+    return sorted(collapse_subdomains(domains))
+
+def get_cpu_pool():
+    global CPU_POOL
+    if CPU_POOL is None:
+        CPU_POOL = ProcessPoolExecutor(max_workers=CPU_WORKERS)
+    return CPU_POOL
+
+async def collapse_domains(domains):
+    # Большие списки сворачиваем в пуле процессов, чтобы не блокировать цикл событий
+    if len(domains) < CPU_OFFLOAD_THRESHOLD:
+        return filter_domains_list(domains)
+    loop = asyncio.get_running_loop()
+    collapsed = await loop.run_in_executor(get_cpu_pool(), collapse_subdomains, list(domains))
+    return sorted(collapsed)
+
+def create_session(settings):
+    # Одна сессия на запуск: keep-alive, лимиты соединений и кэш DNS
+    connector = aiohttp.TCPConnector(
+        limit=settings.get('connection_limit', DEFAULT_CONNECTION_LIMIT),
+        limit_per_host=settings.get('connection_limit_per_host', DEFAULT_CONNECTION_LIMIT_PER_HOST),
+        ttl_dns_cache=settings.get('dns_cache_ttl', DEFAULT_DNS_CACHE_TTL),
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        sock_connect=settings.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+        sock_read=settings.get('read_timeout', DEFAULT_READ_TIMEOUT),
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+def is_remote(source):
+    return source.startswith(('http://', 'https://'))
+
+async def refresh_source(session, url):
+    # Условный запрос: sha256 тела в HTTP-кэше или None, если копии нет
+    try:
+        sha256 = await refresh(session, url)
+    except Exception as e:
+        print(f"Download error: {url} - {e}")
+        return None
+    if sha256 is None:
+        print(f"Download error: {url} - not available and not cached")
+    return sha256
 
-    sorted_domains = sorted(set(domains), key=lambda x: x.count('.'))
-    filtered_domains = []
+def parse_source_domains(url):
+    # Разбор тела из HTTP-кэша; выполняется в потоке, чтобы не задерживать загрузки
+    domains = set()
+    for lines in cached_lines(url):
+        domains.update(normalize_lines(lines, expand_regexp=generate_from_regex))
+    return domains
+
+async def run_git(*args):
+    process = await asyncio.create_subprocess_exec(
+        "git", *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    stdout, _ = await process.communicate()
+    return process.returncode, stdout.decode().strip()
 
-    for domain in sorted_domains:
-        is_subdomain = False
-        for existing_domain in filtered_domains:
-            if domain.endswith('.' + existing_domain):
-                is_subdomain = True
-                break
-        if not is_subdomain:
-            filtered_domains.append(domain)
+_v2fly_commit = None
 
-    return sorted(filtered_domains)
+async def update_v2fly_mirror():
+    # Постоянное зеркало: при повторных запусках только fetch последнего коммита
+    global _v2fly_commit
+    if _v2fly_commit is not None:
+        return _v2fly_commit
 
-async def download_content(url):
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, timeout=10) as response:
-                response.raise_for_status()
-                return await response.text()
+        if os.path.isdir(os.path.join(V2FLY_MIRROR_DIR, ".git")):
+            await run_git("-C", V2FLY_MIRROR_DIR, "remote", "set-url", "origin", V2FLY_REPO_URL)
+            code, _ = await run_git("-C", V2FLY_MIRROR_DIR, "fetch", "--depth", "1", "origin", "HEAD")
+            if code == 0:
+                await run_git("-C", V2FLY_MIRROR_DIR, "reset", "--hard", "FETCH_HEAD")
+            else:
+                print("Warning: failed to update v2fly mirror, using local copy")
+        else:
+            os.makedirs(os.path.dirname(V2FLY_MIRROR_DIR), exist_ok=True)
+            code, _ = await run_git("clone", "--depth", "1", "--sparse", V2FLY_REPO_URL, V2FLY_MIRROR_DIR)
+            if code != 0:
+                shutil.rmtree(V2FLY_MIRROR_DIR, ignore_errors=True)
+                return None
+            await run_git("-C", V2FLY_MIRROR_DIR, "sparse-checkout", "set", "data")
+
+        code, commit = await run_git("-C", V2FLY_MIRROR_DIR, "rev-parse", "HEAD")
     except Exception:
         return None
+    if code != 0 or not commit:
+        return None
 
-async def process_domain_source(source):
-    domains = set()
-    if source.startswith(('http://', 'https://')):
-        content = await download_content(source)
-        if content:
-            for line in content.splitlines():
-                result = clean_domain_line(line)
-                if isinstance(result, list):
-                    domains.update(result)
-                elif result:
-                    domains.add(result)
-    else:
-        result = clean_domain_line(source)
-        if isinstance(result, list):
-            domains.update(result)
-        elif result:
-            domains.add(result)
-    return domains
+    _v2fly_commit = commit
+    return commit
 
-async def parse_v2fly_file(filename, visited=None):
-    if visited is None:
-        visited = set()
-    if filename in visited:
-        return set()
-    visited.add(filename)
-    path = os.path.join(V2FLY_DATA_DIR, filename)
-    if not os.path.isfile(path):
-        return set()
+_code_digest = None
 
-    domains = set()
-    async with aiofiles.open(path, 'r', encoding='utf-8') as f:
-        for raw_line in await f.readlines():
-            line = raw_line.strip()
-            if not line or line.startswith("#"):
-                continue
-            if line.startswith("include:"):
-                included_file = line.split("include:")[1].strip()
-                included_domains = await parse_v2fly_file(included_file, visited)
-                domains |= included_domains
-            else:
-                cleaned = clean_domain_line(line)
-                if isinstance(cleaned, list):
-                    domains |= set(cleaned)
-                elif cleaned:
-                    domains.add(cleaned)
-    return domains
+def code_digest():
+    # Хеш кода разбора: входит в хеш входных данных списков и ключ кэша v2fly
+    global _code_digest
+    if _code_digest is None:
+        _code_digest = source_digest([__file__] + [sys.modules[name].__file__ for name in CODE_MODULES])
+    return _code_digest
 
-async def process_v2fly_categories(categories):
-    if not categories:
+async def load_v2fly_cache(commit):
+    # Разобранные категории для данного коммита v2fly и текущего кода разбора
+    if not os.path.exists(V2FLY_CACHE_FILE):
         return {}
-    if os.path.exists(V2FLY_CLONE_DIR):
-        shutil.rmtree(V2FLY_CLONE_DIR, ignore_errors=True)
-    os.makedirs(os.path.dirname(V2FLY_CLONE_DIR), exist_ok=True)
-
     try:
-        process = await asyncio.create_subprocess_exec(
-            "git", "clone", "--depth", "1", V2FLY_REPO_URL, V2FLY_CLONE_DIR,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
-        await process.wait()
-        if process.returncode != 0:
-            return {}
-    except Exception:
+        async with aiofiles.open(V2FLY_CACHE_FILE, 'r') as f:
+            cache = json.loads(await f.read())
+    except (OSError, ValueError):
         return {}
-
-    tasks = [parse_v2fly_file(category) for category in categories]
-    results = await asyncio.gather(*tasks)
+    if cache.get('version') != V2FLY_CACHE_VERSION or cache.get('commit') != commit \
+            or cache.get('code') != code_digest():
+        return {}
+    return cache.get('categories', {})
+
+async def save_v2fly_cache(commit, categories):
+    cache = {
+        'version': V2FLY_CACHE_VERSION,
+        'commit': commit,
+        'code': code_digest(),
+        'categories': {name: sorted(domains) for name, domains in categories.items()},
+    }
+    os.makedirs(os.path.dirname(V2FLY_CACHE_FILE), exist_ok=True)
+    async with aiofiles.open(V2FLY_CACHE_FILE, 'w') as f:
+        await f.write(json.dumps(cache))
+
+async def process_v2fly_categories(categories, table):
+    # Возвращает ({категория: DomainSet}, {категория: хеш содержимого})
+    if not categories:
+        return {}, {}
+
+    commit = await update_v2fly_mirror()
+    if commit is None:
+        return {}, {}
+
+    cached = await load_v2fly_cache(commit)
+    missing = [category for category in categories if category not in cached]
+    if missing:
+        resolver = V2flyResolver(V2FLY_DATA_DIR, expand_regexp=generate_from_regex)
+        partial = set()
+        for category in missing:
+            cached[category] = resolver.domains(category)
+            # Отказ regexp по времени в кэш не попадает, поэтому и неполная категория тоже
+            if any(REGEX_EXPANDER.timed_out(pattern) for pattern in resolver.regexps(category)):
+                partial.add(category)
+        await save_v2fly_cache(commit, {
+            category: domains for category, domains in cached.items() if category not in partial
+        })
 
     category_data = {}
-    for i, category in enumerate(categories):
-        if results[i]:
-            category_data[category] = results[i]
-    return category_data
-
-async def save_service_domains(service_name, domains):
-    service_dir = os.path.join(CATEGORIES_DIR, service_name)
-    service_file = os.path.join(service_dir, f"{service_name}.lst")
-    os.makedirs(service_dir, exist_ok=True)
-
-    existing_domains = set()
-    if os.path.exists(service_file):
-        async with aiofiles.open(service_file, 'r') as f:
-            content = await f.read()
-            existing_domains = set(line.strip() for line in content.splitlines() if line.strip())
-
-    all_domains = existing_domains | domains
-    filtered_domains = filter_domains_list(list(all_domains))
-
-    async with aiofiles.open(service_file, 'w') as f:
-        await f.write("\n".join(filtered_domains) + "\n")
+    category_digests = {}
+    for category in categories:
+        if cached.get(category):
+            category_data[category] = table.set_of(cached[category])
+            category_digests[category] = hash_domains(cached[category])
+    return category_data, category_digests
+
+async def read_domains_file(path):
+    if not os.path.exists(path):
+        return set()
+    async with aiofiles.open(path, 'r') as f:
+        content = await f.read()
+    return set(line.strip() for line in content.splitlines() if line.strip())
 
-    return set(filtered_domains)
+async def save_domains_list(list_file, domain_set, table):
+    # Новые домены добавляются к текущему содержимому файла
+    os.makedirs(os.path.dirname(list_file), exist_ok=True)
+    existing_domains = await read_domains_file(list_file)
 
-async def save_group_domains(group_name, domains):
-    group_dir = os.path.join(GROUPS_DIR, group_name)
-    group_file = os.path.join(group_dir, f"{group_name}.lst")
-    os.makedirs(group_dir, exist_ok=True)
+    all_domains = existing_domains.union(table.names(domain_set))
+    filtered_domains = await collapse_domains(all_domains)
 
-    existing_domains = set()
-    if os.path.exists(group_file):
-        async with aiofiles.open(group_file, 'r') as f:
-            content = await f.read()
-            existing_domains = set(line.strip() for line in content.splitlines() if line.strip())
+    async with aiofiles.open(list_file, 'w') as f:
+        await f.write("\n".join(filtered_domains) + "\n")
 
-    all_domains = existing_domains | set(domains)
-    filtered_domains = filter_domains_list(list(all_domains))
+    return table.set_of(filtered_domains)
+
+def service_file(service_name):
+    return os.path.join(CATEGORIES_DIR, service_name, f"{service_name}.lst")
+
+def group_file(group_name):
+    return os.path.join(GROUPS_DIR, group_name, f"{group_name}.lst")
+
+class ListBuild:
+    # Состояние одного запуска. Для каждого списка входные данные хешируются
+    # до разбора: неизмененный сервис или группа берется из файла без
+    # разбора источников, исключения собираются только если что-то
+    # пересчитывается. Источник, тело которого изменилось с прошлого запуска,
+    # разбирается в потоке сразу после своего условного запроса, пока
+    # остальные еще загружаются. Если источник недоступен и его нет в кэше,
+    # зависящие от него списки остаются прежними.
+
+    def __init__(self, plan, session, registry, table, v2fly_data, v2fly_digests, semaphore):
+        self.plan = plan
+        self.session = session
+        self.registry = registry
+        self.table = table
+        self.v2fly_data = v2fly_data
+        self.v2fly_digests = v2fly_digests
+        self.semaphore = semaphore
+        self.code_digest = code_digest()
+        self._inputs = {}
+        self._parsed = {}
+        self._excluded_inputs = None
+        self._exclusions = None
+
+    async def refresh_url(self, url):
+        # Один условный запрос на url за запуск
+        return await self.registry.get(url, lambda: self._refresh(url))
+
+    async def _refresh(self, url):
+        sha256 = await refresh_source(self.session, url)
+        if sha256 is not None:
+            key = SOURCE_KEY_PREFIX + url
+            if BUILD_MANIFEST.previous(key) != sha256:
+                # Изменившийся источник почти наверняка понадобится
+                self.parsed_source(url)
+            BUILD_MANIFEST.record(key, sha256)
+        return sha256
+
+    def item_inputs(self, item):
+        # (хеш входных данных, {url: sha256 тела или None}), один раз на элемент плана
+        if item not in self._inputs:
+            self._inputs[item] = asyncio.ensure_future(self._load_item_inputs(item))
+        return self._inputs[item]
+
+    async def _load_item_inputs(self, item):
+        urls = [url for url in item.urls if is_remote(url)]
+        digests = dict(zip(urls, await asyncio.gather(*(self.refresh_url(url) for url in urls))))
+        inputs = digest(
+            type(item).__name__, item._asdict(), self.code_digest,
+            [digests.get(url) for url in item.urls],
+            [self.v2fly_digests.get(category) for category in item.v2fly],
+        )
+        return inputs, digests
+
+    def excluded_inputs(self):
+        # (хеш входных данных excluded сервисов, все ли их источники доступны)
+        if self._excluded_inputs is None:
+            self._excluded_inputs = asyncio.ensure_future(self._load_excluded_inputs())
+        return self._excluded_inputs
+
+    async def _load_excluded_inputs(self):
+        excluded = [service for service in self.plan.services if not service.general]
+        results = await asyncio.gather(*(self.item_inputs(service) for service in excluded))
+        complete = all(None not in digests.values() for _, digests in results)
+        return digest(*[inputs for inputs, _ in results]), complete
+
+    async def parse_url(self, url):
+        # Разбор в потоке, интернирование - на цикле событий
+        loop = asyncio.get_running_loop()
+        try:
+            domains = await loop.run_in_executor(None, parse_source_domains, url)
+        except Exception as e:
+            print(f"Parse error: {url} - {e}")
+            return DomainSet()
+        return self.table.set_of(domains)
+
+    def parsed_source(self, url):
+        # Разбор url, один раз за запуск
+        if url not in self._parsed:
+            self._parsed[url] = asyncio.ensure_future(self.parse_url(url))
+        return self._parsed[url]
+
+    async def process_domain_source(self, source, digests):
+        if not is_remote(source):
+            return self.table.set_of(clean_domains((source,), clean_domain_line))
+        if digests.get(source) is None:
+            return DomainSet()
+        return await self.parsed_source(source)
+
+    async def collect_domains(self, plan_item):
+        # Домены сервиса или группы из URL, явного списка и v2fly категорий
+        _, digests = await self.item_inputs(plan_item)
+        sets = [self.table.set_of(clean_domains(plan_item.domains, clean_domain_line))]
+        sets.extend(await asyncio.gather(*(
+            self.process_domain_source(url, digests) for url in plan_item.urls
+        )))
+        for category in plan_item.v2fly:
+            if category in self.v2fly_data:
+                sets.append(self.v2fly_data[category])
+        return DomainSet.union_all(sets)
+
+    def exclusions(self):
+        # Маски исключений (без родителей и с родителями), собираются один раз
+        if self._exclusions is None:
+            self._exclusions = asyncio.ensure_future(self._load_exclusions())
+        return self._exclusions
+
+    async def _load_exclusions(self):
+        async def collect(service):
+            async with self.semaphore:
+                return await self.collect_domains(service)
+
+        excluded = [service for service in self.plan.services if not service.general]
+        all_excluded = DomainSet.union_all(await asyncio.gather(*(collect(s) for s in excluded)))
+
+        # Исключения проверяются по строке один раз на домен таблицы:
+        # сами исключенные домены и их поддомены, для domains.lst еще и родители.
+        # ~2 мкс на домен, поэтому проверка остается на цикле событий: передача
+        # индекса и строк в процесс обошлась бы дороже самой проверки
+        index = ExclusionIndex(self.table.names(all_excluded))
+        excluded_mask = self.table.mask(lambda domain: index.is_excluded(domain, ancestors=False))
+        return excluded_mask, self.table.mask(index.is_excluded)
+
+    async def previous_list(self, list_file):
+        # Прежнее содержимое списка, если его источник недоступен и не в кэше
+        print(f"Warning: keeping previous {list_file}, some sources are unavailable")
+        domains = await read_domains_file(list_file)
+        return self.table.set_of(domains) if domains else None
+
+    async def build_service(self, service):
+        # DomainSet списка сервиса или None, если после исключений он пуст
+        list_file = service_file(service.name)
+        (item_inputs, digests), (excluded_inputs, excluded_complete) = await asyncio.gather(
+            self.item_inputs(service), self.excluded_inputs()
+        )
+        if None in digests.values() or not excluded_complete:
+            return await self.previous_list(list_file)
+
+        inputs = digest(item_inputs, excluded_inputs)
+        if BUILD_MANIFEST.is_current(list_file, digest(inputs, hash_file(list_file))):
+            if BUILD_MANIFEST.result(list_file) == EMPTY_RESULT:
+                return None
+            return self.table.set_of(await read_domains_file(list_file))
+
+        excluded_mask, _ = await self.exclusions()
+        async with self.semaphore:
+            service_set = await self.collect_domains(service)
+
+            # Исключаем домены excluded сервисов и их поддомены
+            service_set = service_set.difference(excluded_mask.ids())
+            if not service_set:
+                # Файл не трогаем, но запоминаем, что при тех же входных данных сервис пуст
+                BUILD_MANIFEST.record(list_file, digest(inputs, hash_file(list_file)), EMPTY_RESULT)
+                return None
+            result = await save_domains_list(list_file, service_set, self.table)
+
+        BUILD_MANIFEST.record(list_file, digest(inputs, hash_file(list_file)))
+        return result
+
+    async def group_domains(self, group, service_sets):
+        group_set = await self.collect_domains(group)
+
+        # include сервисы (ссылки уже разрешены в плане с учетом general)
+        group_set = DomainSet.union_all(
+            [group_set] + [service_sets.get(service_key) for service_key in group.includes]
+        )
+        filtered_domains = await collapse_domains(self.table.names(group_set))
+        return self.table.set_of(filtered_domains)
+
+    async def build_group(self, group, service_sets, service_digests):
+        # Только general группы: остальные не пишутся и не входят в domains.lst.
+        # Возвращает (хеш входных данных, домены группы или None, если группа
+        # не изменилась и ее домены еще не понадобились)
+        list_file = group_file(group.name)
+        item_inputs, digests = await self.item_inputs(group)
+        inputs = digest(
+            item_inputs,
+            [service_digests.get(service_key) for service_key in group.includes],
+        )
+        if None in digests.values():
+            return inputs, await self.previous_list(list_file) or DomainSet()
+        if BUILD_MANIFEST.is_current(list_file, digest(inputs, hash_file(list_file))):
+            return inputs, None
+
+        async with self.semaphore:
+            group_set = await self.group_domains(group, service_sets)
+            await save_domains_list(list_file, group_set, self.table)
+
+        BUILD_MANIFEST.record(list_file, digest(inputs, hash_file(list_file)))
+        return inputs, group_set
+
+    async def build(self):
+        # Сервисы: неизмененные читаются из файлов, остальные пересчитываются
+        services = [service for service in self.plan.services if service.general]
+        service_results = await asyncio.gather(*(self.build_service(s) for s in services))
+        service_sets = {}
+        service_digests = {}
+        for service, service_set in zip(services, service_results):
+            if service_set:
+                service_sets[service.key] = service_set
+                service_digests[service.key] = hash_file(service_file(service.name))
+
+        groups = [group for group in self.plan.groups if group.general]
+        group_results = await asyncio.gather(*(
+            self.build_group(group, service_sets, service_digests) for group in groups
+        ))
+
+        excluded_inputs, excluded_complete = await self.excluded_inputs()
+        if not excluded_complete:
+            # Без полного списка исключений domains.lst не пересчитываем
+            print(f"Warning: keeping previous {DOMAINS_FILE}, some sources are unavailable")
+            return
+
+        final_inputs = digest(
+            excluded_inputs,
+            sorted(service_digests.items()),
+            [inputs for inputs, _ in group_results],
+        )
+        if BUILD_MANIFEST.is_current(DOMAINS_FILE, digest(final_inputs, hash_file(DOMAINS_FILE))):
+            return
 
-    async with aiofiles.open(group_file, 'w') as f:
-        await f.write("\n".join(filtered_domains) + "\n")
+        excluded_mask, final_mask = await self.exclusions()
 
-    return set(filtered_domains)
-
-async def process_excluded_service(service_name, service_config):
-    service_excluded_domains = set()
-
-    urls = service_config.get('url', [])
-    if isinstance(urls, str):
-        urls = [urls]
-
-    url_tasks = [process_domain_source(url) for url in urls]
-    url_results = await asyncio.gather(*url_tasks)
-    for domains in url_results:
-        service_excluded_domains |= domains
-
-    domains_list = service_config.get('domains', [])
-    if isinstance(domains_list, str):
-        domains_list = [domains_list]
-    for domain in domains_list:
-        result = clean_domain_line(domain)
-        if isinstance(result, list):
-            service_excluded_domains.update(result)
-        elif result:
-            service_excluded_domains.add(result)
-
-    if 'v2fly' in service_config:
-        categories = service_config['v2fly']
-        if isinstance(categories, str):
-            categories = [categories]
-
-        excluded_v2fly_data = await process_v2fly_categories(categories)
-        for category in categories:
-            if category in excluded_v2fly_data:
-                service_excluded_domains |= excluded_v2fly_data[category]
-
-    if service_excluded_domains:
-        await save_service_domains(service_name, service_excluded_domains)
-
-    return service_excluded_domains
-
-async def process_non_excluded_service(service_name, service_config, v2fly_data, all_excluded_domains):
-    service_domains = set()
-
-    urls = service_config.get('url', [])
-    if isinstance(urls, str):
-        urls = [urls]
-
-    url_tasks = [process_domain_source(url) for url in urls]
-    url_results = await asyncio.gather(*url_tasks)
-    for domains in url_results:
-        service_domains |= domains
-
-    domains_list = service_config.get('domains', [])
-    if isinstance(domains_list, str):
-        domains_list = [domains_list]
-    for domain in domains_list:
-        result = clean_domain_line(domain)
-        if isinstance(result, list):
-            service_domains.update(result)
-        elif result:
-            service_domains.add(result)
-
-    if 'v2fly' in service_config:
-        categories = service_config['v2fly']
-        if isinstance(categories, str):
-            categories = [categories]
-        for category in categories:
-            if category in v2fly_data:
-                category_domains = v2fly_data[category] - all_excluded_domains
-                service_domains |= category_domains
-
-    service_domains = service_domains - all_excluded_domains
-
-    if service_domains:
-        filtered_service_domains = await save_service_domains(service_name, service_domains)
-        return filtered_service_domains
-    return set()
-
-def should_include_service(service_general, group_general):
-    if service_general is False:
-        return False
-    if service_general is True:
-        return True
-    if service_general is None:
-        service_general = True
-
-    if group_general is None:
-        group_general = True
-
-    return service_general and group_general
-
-async def process_group(group_name, group_config, v2fly_data, service_domains_dict, service_general_dict):
-    group_domains = set()
-
-    # Direct domains
-    domains_list = group_config.get('domains', [])
-    if isinstance(domains_list, str):
-        domains_list = [domains_list]
-    for domain in domains_list:
-        result = clean_domain_line(domain)
-        if isinstance(result, list):
-            group_domains.update(result)
-        elif result:
-            group_domains.add(result)
-
-    # URLs
-    urls = group_config.get('url', [])
-    if isinstance(urls, str):
-        urls = [urls]
-    url_tasks = [process_domain_source(url) for url in urls]
-    url_results = await asyncio.gather(*url_tasks)
-    for domains in url_results:
-        group_domains |= domains
-
-    # v2fly
-    if 'v2fly' in group_config:
-        categories = group_config['v2fly']
-        if isinstance(categories, str):
-            categories = [categories]
-        for category in categories:
-            if category in v2fly_data:
-                group_domains |= v2fly_data[category]
-
-    # include сервисы
-    include_list = group_config.get('include', [])
-    if isinstance(include_list, str):
-        include_list = [include_list]
-
-    group_general = group_config.get('general')
-    if group_general is None:
-        group_general = True
-    elif isinstance(group_general, str):
-        group_general = group_general.lower() == 'true'
-
-    # Создаем нормализованный словарь для сервисов
-    normalized_service_general_dict = {k.lower(): v for k, v in service_general_dict.items()}
-    normalized_service_domains_dict = {k.lower(): v for k, v in service_domains_dict.items()}
-
-    for service_name in include_list:
-        key = service_name.strip().lower()
-        if key in normalized_service_general_dict:
-            service_domains = normalized_service_domains_dict.get(key, set())
-            service_general = normalized_service_general_dict[key]
-
-            if should_include_service(service_general, group_general):
-                group_domains |= service_domains
-        else:
-            print(f"Warning: Service '{service_name}' not found in configuration")
+        # Существующие домены без исключенных
+        personal_set = self.table.set_of(await read_domains_file(DOMAINS_FILE))
+        personal_set = personal_set.difference(excluded_mask.ids())
+
+        # Собираем все разрешенные домены; неизмененные группы досчитываются
+        allowed_sets = list(service_sets.values())
+        allowed_sets.append(personal_set)
+        for group, (_, group_set) in zip(groups, group_results):
+            if group_set is None:
+                group_set = await self.group_domains(group, service_sets)
+            allowed_sets.append(group_set)
 
-    filtered_domains = filter_domains_list(list(group_domains))
+        all_allowed = DomainSet.union_all(allowed_sets)
 
-    if group_general:
-        await save_group_domains(group_name, filtered_domains)
+        # ЖЕСТКАЯ ФИЛЬТРАЦИЯ В КОНЦЕ
+        # Убираем исключенные домены, их поддомены и их родителей
+        final_domains = self.table.names(all_allowed.difference(final_mask.ids()))
 
-    return set(filtered_domains), group_general
+        # Сохраняем финальные домены
+        if final_domains:
+            filtered_final_domains = await collapse_domains(final_domains)
+            async with aiofiles.open(DOMAINS_FILE, 'w') as f:
+                await f.write("\n".join(sorted(filtered_final_domains)) + "\n")
+            BUILD_MANIFEST.record(DOMAINS_FILE, digest(final_inputs, hash_file(DOMAINS_FILE)))
 
 async def async_main():
+    global CPU_POOL, CPU_WORKERS
+
     if not os.path.exists(CONFIG_PATH):
         raise FileNotFoundError(f"Config file not found: {CONFIG_PATH}")
 
-    async with aiofiles.open(CONFIG_PATH, 'rb') as f:
-        content = await f.read()
-        config = tomllib.loads(content.decode('utf-8'))
-
-    services = config.get('services', {})
-    groups = config.get('groups', {})
-
-    # Словари для хранения данных сервисов
-    service_domains_dict = {}
-    service_general_dict = {}
-    all_excluded_domains = set()
-
-    # Собираем все v2fly категории
-    v2fly_categories = set()
-    for service_config in services.values():
-        if 'v2fly' in service_config:
-            categories = service_config['v2fly']
-            if isinstance(categories, str):
-                v2fly_categories.add(categories)
-            elif isinstance(categories, list):
-                v2fly_categories.update(categories)
-    for group_config in groups.values():
-        if 'v2fly' in group_config:
-            categories = group_config['v2fly']
-            if isinstance(categories, str):
-                v2fly_categories.add(categories)
-            elif isinstance(categories, list):
-                v2fly_categories.update(categories)
-
-    # Обрабатываем v2fly категории
-    v2fly_data = {}
-    if v2fly_categories:
-        v2fly_data = await process_v2fly_categories(list(v2fly_categories))
-
-    # Определяем флаги general для сервисов (регистронезависимо)
-    for service_name, service_config in services.items():
-        flag = service_config.get('general', True)
-        if isinstance(flag, str):
-            flag = flag.strip().lower() != 'false'
-        service_general_dict[service_name.lower()] = flag
-
-    # Собираем домены всех исключенных сервисов
-    for service_name, service_config in services.items():
-        service_name_lower = service_name.lower()
-        if not service_general_dict.get(service_name_lower, True):
-            # Обрабатываем URL
-            urls = service_config.get('url', [])
-            if isinstance(urls, str):
-                urls = [urls]
-            url_tasks = [process_domain_source(url) for url in urls]
-            url_results = await asyncio.gather(*url_tasks)
-            for domains in url_results:
-                all_excluded_domains |= domains
-
-            # Обрабатываем явные домены
-            domains_list = service_config.get('domains', [])
-            if isinstance(domains_list, str):
-                domains_list = [domains_list]
-            for domain in domains_list:
-                result = clean_domain_line(domain)
-                if isinstance(result, list):
-                    all_excluded_domains.update(result)
-                elif result:
-                    all_excluded_domains.add(result)
-
-            # Обрабатываем v2fly категории
-            if 'v2fly' in service_config:
-                categories = service_config['v2fly']
-                if isinstance(categories, str):
-                    categories = [categories]
-                for category in categories:
-                    if category in v2fly_data:
-                        all_excluded_domains |= v2fly_data[category]
-
-    # Обрабатываем обычные сервисы (non-excluded)
-    for service_name, service_config in services.items():
-        service_name_lower = service_name.lower()
-        if service_general_dict.get(service_name_lower, True):
-            service_domains = set()
-
-            # Обрабатываем URL
-            urls = service_config.get('url', [])
-            if isinstance(urls, str):
-                urls = [urls]
-            url_tasks = [process_domain_source(url) for url in urls]
-            url_results = await asyncio.gather(*url_tasks)
-            for domains in url_results:
-                service_domains |= domains
-
-            # Обрабатываем явные домены
-            domains_list = service_config.get('domains', [])
-            if isinstance(domains_list, str):
-                domains_list = [domains_list]
-            for domain in domains_list:
-                result = clean_domain_line(domain)
-                if isinstance(result, list):
-                    service_domains.update(result)
-                elif result:
-                    service_domains.add(result)
-
-            # Обрабатываем v2fly категории
-            if 'v2fly' in service_config:
-                categories = service_config['v2fly']
-                if isinstance(categories, str):
-                    categories = [categories]
-                for category in categories:
-                    if category in v2fly_data:
-                        service_domains |= v2fly_data[category]
-
-            # Исключаем домены из excluded сервисов
-            service_domains -= all_excluded_domains
-
-            if service_domains:
-                filtered_domains = await save_service_domains(service_name, service_domains)
-                service_domains_dict[service_name_lower] = filtered_domains
-
-    # Обрабатываем существующие домены
-    existing_domains = set()
-    if os.path.exists(DOMAINS_FILE):
-        async with aiofiles.open(DOMAINS_FILE, 'r') as f:
-            content = await f.read()
-            existing_domains = set(line.strip() for line in content.splitlines() if line.strip())
-
-    # Фильтруем существующие домены
-    filtered_personal_domains = existing_domains - all_excluded_domains
-
-    # Собираем все разрешенные домены
-    all_allowed_domains = set()
-    for domains in service_domains_dict.values():
-        all_allowed_domains |= domains
-    all_allowed_domains |= filtered_personal_domains
-
-    # Обрабатываем группы
-    if groups:
-        group_tasks = []
-        for group_name, group_config in groups.items():
-            group_tasks.append(process_group(
-                group_name, 
-                group_config, 
-                v2fly_data,
-                service_domains_dict,
-                service_general_dict
-            ))
-
-        group_results = await asyncio.gather(*group_tasks)
-
-        for domains, group_general in group_results:
-            if group_general:
-                all_allowed_domains |= domains
-
-    # ЖЕСТКАЯ ФИЛЬТРАЦИЯ В КОНЦЕ
-    final_domains = set()
-    for domain in all_allowed_domains:
-        # Проверяем, не является ли домен поддоменом исключенного
-        is_excluded = False
-        for excluded_domain in all_excluded_domains:
-            if (domain == excluded_domain or 
-                domain.endswith('.' + excluded_domain) or 
-                excluded_domain.endswith('.' + domain)):
-                is_excluded = True
-                break
-        if not is_excluded:
-            final_domains.add(domain)
-
-    # Сохраняем финальные домены
-    if final_domains:
-        filtered_final_domains = filter_domains_list(list(final_domains))
-        async with aiofiles.open(DOMAINS_FILE, 'w') as f:
-            await f.write("\n".join(sorted(filtered_final_domains)) + "\n")
-
-async def main_async():
-    await async_main()
-    if os.path.exists(V2FLY_CLONE_DIR):
-        shutil.rmtree(V2FLY_CLONE_DIR, ignore_errors=True)
+    plan = load_plan(
+        CONFIG_PATH,
+        lambda content: tomllib.loads(content.decode('utf-8')),
+        BUILD_PLAN_FILE
+    )
+    for group_name, service_name in plan.unknown_references:
+        print(f"Warning: Service '{service_name}' (group '{group_name}') not found in configuration")
+
+    CPU_WORKERS = plan.settings.get('cpu_workers')
+    try:
+        await build_lists(plan)
+    finally:
+        if CPU_POOL is not None:
+            CPU_POOL.shutdown()
+            CPU_POOL = None
+
+    REGEX_EXPANDER.save()
+    BUILD_MANIFEST.save()
+    print(BUILD_MANIFEST.report())
+
+async def build_lists(plan):
+    async with create_session(plan.settings) as session:
+        registry = FetchRegistry()
+        # Каждый домен интернируется один раз при разборе источника,
+        # множества хранятся как массивы ID до записи списков
+        table = DomainTable()
+
+        # Обрабатываем v2fly категории
+        v2fly_data, v2fly_digests = await process_v2fly_categories(list(plan.v2fly_categories), table)
+
+        semaphore = asyncio.Semaphore(plan.settings.get('service_concurrency', DEFAULT_SERVICE_CONCURRENCY))
+        build = ListBuild(plan, session, registry, table, v2fly_data, v2fly_digests, semaphore)
+        await build.build()
+
+        print(registry.report())
 
 if __name__ == "__main__":
-    asyncio.run(main_async())
\ No newline at end of file
+    asyncio.run(async_main())
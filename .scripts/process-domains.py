@@ -1,13 +1,21 @@
 import os
 import re
 import shutil
+import time
 import locale
-from urllib.parse import urlparse
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from common.http_cache import stream_lines_sync
+from common.normalize import is_ipv4, normalize_line, normalize_lines
+from common.suffix_index import collapse_subdomains
+from common.variants import build_variants, load_variants
+
+FETCH_WORKERS = 8
 
 class DomainProcessor:
     def __init__(self):
         self.set_collation()
+        # Ключи сортировки считаются один раз на домен за запуск
+        self._sort_keys = {}
     
     def set_collation(self):
         try:
@@ -16,66 +24,37 @@ class DomainProcessor:
             os.environ['LC_ALL'] = 'C'
 
     def clean_line(self, line):
-        line = re.sub(r'^\s*-\s*', '', line)
-        line = re.sub(r'^\s*(#|;|//|--).*', '', line)
-        line = re.sub(r'^full:', '', line)
-        line = re.sub(r'^(https?://|//)', '', line)
-        line = re.sub(r'[/:].*$', '', line)
-        line = re.sub(r'^www[2-9]?\.', '', line)
-        return line.strip()
+        return normalize_line(line, single_label=True) or ''
 
     def read_lines(self, file_path):
         with open(file_path, 'r') as f:
-            return [self.clean_line(line) for line in f if self.clean_line(line)]
+            lines = f.read().splitlines()
+        # Одиночные метки (например, ua) в списках допустимы
+        return list(normalize_lines(lines, single_label=True))
 
     def write_lines(self, file_path, lines):
         with open(file_path, 'w') as f:
-            f.write('\n'.join(sorted(set(lines), key=locale.strxfrm)) + '\n')
+            f.write('\n'.join(self.sort_domains(lines)) + '\n')
+
+    def sort_key(self, domain):
+        key = self._sort_keys.get(domain)
+        if key is None:
+            key = self._sort_keys[domain] = (locale.strxfrm(domain), domain)
+        return key
 
     def sort_domains(self, domains):
-        return sorted(set(domains), key=lambda x: (locale.strxfrm(x), x))
+        return sorted(set(domains), key=self.sort_key)
 
     def filter_subdomains(self, domains):
-        sorted_domains = sorted(domains, key=lambda x: x.count('.'))
-        keep = set()
-        filtered = []
-        
-        for domain in sorted_domains:
-            parents = set()
-            d = domain
-            while '.' in d:
-                d = d.split('.', 1)[1]
-                parents.add(d)
-            
-            if not parents & keep:
-                filtered.append(domain)
-                keep.add(domain)
-        
-        return self.sort_domains(filtered)
+        return self.sort_domains(collapse_subdomains(domains))
 
     def compare_files(self, list1, list2):
-        i = j = 0
-        unique1 = []
-        unique2 = []
-        common = []
-        
-        while i < len(list1) and j < len(list2):
-            a, b = list1[i], list2[j]
-            cmp = locale.strcoll(a, b)
-            
-            if cmp < 0:
-                unique1.append(a)
-                i += 1
-            elif cmp > 0:
-                unique2.append(b)
-                j += 1
-            else:
-                common.append(a)
-                i += 1
-                j += 1
-        
-        unique1.extend(list1[i:])
-        unique2.extend(list2[j:])
+        # Списки уже отсортированы: разность множеств с сохранением порядка
+        set1 = set(list1)
+        set2 = set(list2)
+        unique1 = [d for d in list1 if d not in set2]
+        unique2 = [d for d in list2 if d not in set1]
+        common = [d for d in list1 if d in set2]
         return unique1, unique2, common
 
 class DomainComparator(DomainProcessor):
@@ -87,16 +66,21 @@ class DomainComparator(DomainProcessor):
         self.primary_domains = set()
 
     def process_external_source(self, url):
+        # Возвращает (домены, время загрузки, время разбора)
+        fetch_time = parse_time = 0.0
         try:
-            resp = requests.get(url, timeout=30)
-            resp.raise_for_status()
-            
-            content = re.sub(r'(?m)^\s*#.*$|^\s*$|^[0-9.]+\s+', '', resp.text)
-            domains = [
-                self.clean_line(line)
-                for line in re.sub(r'\s+', '\n', content).split('\n')
-                if re.match(r'^[a-zA-Z0-9-]+\.[a-zA-Z]{2,}', line)
-            ]
+            domains = set()
+            started = time.perf_counter()
+            for lines in stream_lines_sync(url, timeout=30):
+                parsed = time.perf_counter()
+                fetch_time += parsed - started
+                domains |= normalize_lines(lines)
+                started = time.perf_counter()
+                parse_time += started - parsed
+            fetch_time += time.perf_counter() - started
+
+            started = time.perf_counter()
+            domains = [d for d in domains if not is_ipv4(d)]
             
             filtered = []
             for domain in domains:
@@ -110,15 +94,17 @@ class DomainComparator(DomainProcessor):
                 if not is_sub:
                     filtered.append(domain)
             
-            return self.sort_domains(filtered)
+            filtered = self.sort_domains(filtered)
+            parse_time += time.perf_counter() - started
+            return filtered, fetch_time, parse_time
             
         except Exception as e:
             print(f'Error processing {url}: {e}')
-            return []
+            return [], fetch_time, parse_time
 
-    def generate_reports(self, source_url, key, external_domains, primary_sorted):
-        external_sorted = self.sort_domains(external_domains)
-        missing, presence, _ = self.compare_files(external_sorted, primary_sorted)
+    def generate_reports(self, source_url, key, external_domains, primary_sorted, timings=None):
+        # external_domains уже отсортированы в process_external_source
+        missing, presence, _ = self.compare_files(external_domains, primary_sorted)
         
         reports = {
             'missing': missing,
@@ -133,7 +119,10 @@ class DomainComparator(DomainProcessor):
                 )
                 with open(report_file, 'a') as f:
                     f.write(f"# {report_type.capitalize()} domains\n")
-                    f.write(f"# Source: {source_url}\n\n")
+                    f.write(f"# Source: {source_url}\n")
+                    if timings:
+                        f.write(f"# Fetch: {timings[0]:.2f}s, parse: {timings[1]:.2f}s\n")
+                    f.write("\n")
                     f.write('\n'.join([f'- {d}' for d in data]) + '\n\n')
 
     def process_sources(self, primary_domains):
@@ -152,15 +141,18 @@ class DomainComparator(DomainProcessor):
                 for line in f if line.strip() and not line.startswith('#')
             ]
         
-        for url in source_urls:
-            external_domains = self.process_external_source(url)
-            if external_domains:
-                self.generate_reports(
-                    url, 
-                    self.get_source_key(url), 
-                    external_domains, 
-                    primary_sorted
-                )
+        # Источники загружаются параллельно, отчеты пишутся в порядке файла
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+            results = pool.map(self.process_external_source, source_urls)
+            for url, (external_domains, fetch_time, parse_time) in zip(source_urls, results):
+                if external_domains:
+                    self.generate_reports(
+                        url, 
+                        self.get_source_key(url), 
+                        external_domains, 
+                        primary_sorted,
+                        (fetch_time, parse_time)
+                    )
 
     def get_source_key(self, url):
         return re.sub(
@@ -181,9 +173,11 @@ def main():
     )
     comparator.process_sources(filtered_domains)
     
-    yt_domains = processor.read_lines('categories/Services/YouTube/YouTube.lst')
-    non_yt = [d for d in filtered_domains if d not in yt_domains]
-    processor.write_lines('domains-without-yt.lst', non_yt)
+    # Производные варианты (domains-<name>.lst) из секции [variants]
+    variants = load_variants()
+    variant_domains = build_variants(filtered_domains, variants, processor.read_lines)
+    for variant in variants:
+        processor.write_lines(variant.output, variant_domains[variant.name])
 
 if __name__ == '__main__':
     main()
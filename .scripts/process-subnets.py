@@ -3,8 +3,12 @@ import os
 import toml
 import aiohttp
 import asyncio
-import ipaddress
 from pathlib import Path
+from common.bgp_snapshot import BgpSnapshot
+from common.bgp_table import build_asn_index, parse_file
+from common.build_manifest import digest, hash_domains, hash_file
+from common.cidr_merge import merge_networks
+from common.http_cache import decode, fetch_bytes
 
 # ===== LOAD CONFIG =====
 CONFIG_FILE = ".scripts/config/process-subnets.toml"
@@ -15,33 +19,13 @@ SERVICES = config["services"]
 SUMMARY = config["settings"]["summary"]
 USER_AGENT = config["settings"]["user_agent"]
 BGP_URL = config["settings"]["bgp_url"]
+# Источник таблицы можно подменить локальным файлом или адресом (BGP_SOURCE)
+BGP_SOURCE = os.environ.get("BGP_SOURCE") or config["settings"].get("bgp_source") or BGP_URL
+BGP_SNAPSHOT_DIR = "tmp/bgp-snapshot"
+BGP_CONNECT_TIMEOUT = config["settings"].get("bgp_connect_timeout", 30)
+BGP_READ_TIMEOUT = config["settings"].get("bgp_read_timeout", 60)
 # ===== END SETTINGS =====
 
-def merge_networks(network_list):
-    if not network_list:
-        return [], []
-    
-    v4_nets = []
-    v6_nets = []
-    
-    for net_str in network_list:
-        net_str = net_str.strip()
-        if not net_str:
-            continue
-            
-        try:
-            if '.' in net_str:
-                v4_nets.append(ipaddress.IPv4Network(net_str))
-            elif ':' in net_str:
-                v6_nets.append(ipaddress.IPv6Network(net_str))
-        except Exception as e:
-            print(f"Invalid network skipped: {net_str} - {e}")
-    
-    merged_v4 = [str(net) for net in ipaddress.collapse_addresses(v4_nets)] if v4_nets else []
-    merged_v6 = [str(net) for net in ipaddress.collapse_addresses(v6_nets)] if v6_nets else []
-    
-    return merged_v4, merged_v6
-
 def setup_dirs():
     for name in SERVICES:
         Path(f'categories/CIDRs/CIDR4/services/{name}').mkdir(parents=True, exist_ok=True)
@@ -49,9 +33,7 @@ def setup_dirs():
 
 async def download(session, url, params=None):
     try:
-        async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as r:
-            r.raise_for_status()
-            return await r.text()
+        return decode(await fetch_bytes(session, url, params=params, timeout=10))
     except Exception as e:
         print(f"Download error: {url} - {e}")
         return None
@@ -83,49 +65,67 @@ async def process_service(session, name, service_config):
             Path(f'categories/CIDRs/CIDR4/services/{name}/{name.lower()}.lst').write_text('\n'.join(merged_v4))
             Path(f'categories/CIDRs/CIDR6/services/{name}/{name.lower()}.lst').write_text('\n'.join(merged_v6))
 
+def service_files(service):
+    return (
+        Path(f'categories/CIDRs/CIDR4/services/{service}/{service.lower()}.lst'),
+        Path(f'categories/CIDRs/CIDR6/services/{service}/{service.lower()}.lst'),
+    )
+
+async def load_bgp_table(session, snapshot, asn_index):
+    # (хеш таблицы, префиксы, если таблица разобрана при загрузке, файл таблицы)
+    # Локальный файл: воспроизводимый запуск без сети
+    if not BGP_SOURCE.startswith(('http://', 'https://')):
+        return hash_file(BGP_SOURCE), None, BGP_SOURCE
+
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=BGP_CONNECT_TIMEOUT, sock_read=BGP_READ_TIMEOUT)
+    try:
+        cidrs = await snapshot.download(session, BGP_SOURCE, asn_index, timeout=timeout)
+    except Exception as e:
+        print(f"Download error: {BGP_SOURCE} - {e}")
+        return None, None, None
+    return snapshot.digest, cidrs, snapshot.table_path
+
 async def process_asns(session):
-    asn_services = {}
-    for name, service_config in SERVICES.items():
-        if service_config["type"] == "asn" and "asn" in service_config:
-            asn_list = service_config["asn"]
-            if isinstance(asn_list, int):
-                asn_services[name] = [asn_list]
-            else:
-                asn_services[name] = asn_list
-    
-    if not asn_services:
+    asn_index = build_asn_index(SERVICES)
+    if not asn_index:
         return
 
-    if bgp_data := await download(session, BGP_URL):
-        cidrs = {}
-        for line in bgp_data.splitlines():
-            if not line.strip():
-                continue
-            parts = line.split()
-            if len(parts) < 2:
-                continue
-                
-            cidr = parts[0]
-            asn = parts[-1]
-            
-            try:
-                asn_value = int(asn)
-            except ValueError:
-                continue
-                
-            for service, service_asns in asn_services.items():
-                if asn_value in service_asns:
-                    cidrs.setdefault(service, {'v4': set(), 'v6': set()})
-                    target = 'v4' if '.' in cidr else 'v6'
-                    cidrs[service][target].add(cidr)
-
-        for service, ips in cidrs.items():
-            if ips['v4']:
-                merged_v4, _ = merge_networks(sorted(ips['v4']))
-                Path(f'categories/CIDRs/CIDR4/services/{service}/{service.lower()}.lst').write_text('\n'.join(merged_v4))
-            if ips['v6']:
-                _, merged_v6 = merge_networks(sorted(ips['v6']))
-                Path(f'categories/CIDRs/CIDR6/services/{service}/{service.lower()}.lst').write_text('\n'.join(merged_v6))
+    snapshot = BgpSnapshot(BGP_SNAPSHOT_DIR)
+    table_digest, cidrs, table_path = await load_bgp_table(session, snapshot, asn_index)
+    if table_digest is None:
+        if table_path:
+            print(f"BGP table not found: {table_path}")
+        return
+
+    # Таблица и список ASN не менялись, а списки на месте - разбирать нечего
+    parsed_key = digest(table_digest, sorted(asn_index.items()))
+    asn_services = {service for services in asn_index.values() for service in services}
+    if snapshot.is_parsed(parsed_key) and all(
+        path.exists() for service in asn_services for path in service_files(service)
+    ):
+        print("BGP table unchanged, ASN services are up to date")
+        return
+
+    if cidrs is None:
+        cidrs = await asyncio.get_running_loop().run_in_executor(None, parse_file, table_path, asn_index)
+
+    for service, ips in cidrs.items():
+        v4_file, v6_file = service_files(service)
+        # Набор префиксов сервиса не изменился - списки не пересчитываем
+        service_digest = hash_domains(ips['v4'] | ips['v6'])
+        if snapshot.is_service_current(service, service_digest) and \
+                (not ips['v4'] or v4_file.exists()) and (not ips['v6'] or v6_file.exists()):
+            continue
+        if ips['v4']:
+            merged_v4, _ = merge_networks(sorted(ips['v4']))
+            v4_file.write_text('\n'.join(merged_v4))
+        if ips['v6']:
+            _, merged_v6 = merge_networks(sorted(ips['v6']))
+            v6_file.write_text('\n'.join(merged_v6))
+        snapshot.record_service(service, service_digest)
+
+    snapshot.mark_parsed(parsed_key)
+    snapshot.save()
 
 def make_summary():
     all_ips_v4 = set()